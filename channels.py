@@ -19,6 +19,7 @@ class GuildConfig:
             vote_channel_id: int | None = None,
             ban_forum_channel_id: int | None = None,
             counting_channel_id: int | None = None,
+            ticket_inactivity_hours: int | None = None,
     ):
         self.guild_id = guild_id
         self.OPEN_CATEGORY_ID = open_category_id
@@ -36,6 +37,8 @@ class GuildConfig:
         self.vote_channel_id = vote_channel_id
         self.ban_forum_channel_id = ban_forum_channel_id
         self.counting_channel_id = counting_channel_id
+        # Open tickets without a member message for this long are closed automatically; None disables it.
+        self.ticket_inactivity_hours = ticket_inactivity_hours
 
 HOUSE_OF_DEMONS = GuildConfig(
     guild_id=1181909214537461840,
@@ -53,7 +56,8 @@ HOUSE_OF_DEMONS = GuildConfig(
     lvl100=1454436333773914153,
     vote_channel_id=1454573899621859430,
     ban_forum_channel_id=None,
-    counting_channel_id=1263462595755642921
+    counting_channel_id=1263462595755642921,
+    ticket_inactivity_hours=72
 )
 
 INFINITY_EMPIRE = GuildConfig(
@@ -70,7 +74,8 @@ INFINITY_EMPIRE = GuildConfig(
     lvl25=1455673703693156585,
     lvl50=1455673792226529282,
     lvl100=1455673859373142199,
-    vote_channel_id=1455674287095812282
+    vote_channel_id=1455674287095812282,
+    ticket_inactivity_hours=72
 )
 
 ALL_GUILDS = {
@@ -78,5 +83,9 @@ ALL_GUILDS = {
     INFINITY_EMPIRE.guild_id: INFINITY_EMPIRE,
 }
 
+COUNTING_CHANNEL_IDS = {
+    config.counting_channel_id for config in ALL_GUILDS.values() if config.counting_channel_id
+}
+
 def get_config(guild_id: int) -> GuildConfig | None:
     return ALL_GUILDS.get(guild_id)
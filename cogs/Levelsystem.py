@@ -1,16 +1,173 @@
 import discord
 from discord.ext import commands, tasks
-from datetime import datetime, timedelta
+from datetime import datetime, date
 import aiosqlite
 import asyncio
+import hashlib
+import time
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from PIL import Image, ImageDraw, ImageFont
 import io
+import numpy as np
 
 import channels
 
 EXCLUDED_GUILD_ID = 1363137083148865598
 
+RANK_CARD_WIDTH, RANK_CARD_HEIGHT = 1278, 852
+
+# XP needed to go from level l to l + 1 is LEVEL_CURVE_A*l^2 + LEVEL_CURVE_B*l + LEVEL_CURVE_C.
+LEVEL_CURVE_A, LEVEL_CURVE_B, LEVEL_CURVE_C = 5, 50, 100
+LEVELS_SCHEMA_VERSION = 3
+
+# Bit 0 of a user's activity bitmap is this day; bit n is n days later.
+ACTIVITY_EPOCH_DAY = date(2024, 1, 1).toordinal()
+
+def activity_to_blob(activity: int) -> bytes:
+    return activity.to_bytes((activity.bit_length() + 7) // 8, "little")
+
+def activity_from_blob(blob) -> int:
+    return int.from_bytes(blob or b"", "little")
+
+def activity_streak(activity: int, day: int) -> int:
+    """Consecutive active days ending at ``day`` (or the day before, if ``day`` is not active yet)."""
+    end = day - ACTIVITY_EPOCH_DAY
+    if end < 0:
+        return 0
+    if not activity >> end & 1:
+        end -= 1
+    mask = (1 << (end + 1)) - 1
+    inactive = ~activity & mask
+    return end + 1 - inactive.bit_length()
+
+def activity_longest_streak(activity: int) -> int:
+    longest = 0
+    while activity:
+        activity &= activity >> 1
+        longest += 1
+    return longest
+
+def activity_days_in_window(activity: int, day: int, window: int) -> int:
+    end = day - ACTIVITY_EPOCH_DAY
+    start = max(end - window + 1, 0)
+    if end < 0:
+        return 0
+    return (activity >> start & ((1 << (end - start + 1)) - 1)).bit_count()
+
+# Sources recorded in the xp_events ledger.
+XP_SOURCE_MESSAGE = 1
+XP_SOURCE_VOICE = 2
+XP_SOURCE_STREAK = 3
+XP_SOURCE_WEEKEND = 4
+
+def total_xp_for_level(level):
+    """Lifetime XP at which ``level`` is reached. Works on ints and NumPy arrays."""
+    return (LEVEL_CURVE_A * (level - 1) * level * (2 * level - 1)) // 6 + (LEVEL_CURVE_B * (level - 1) * level) // 2 + LEVEL_CURVE_C * level
+
+def level_for_total_xp(total_xp):
+    """Closed-form inverse of total_xp_for_level. Works on ints and NumPy arrays.
+
+    total_xp_for_level(L) = T is the cubic L^3 + b*L^2 + c*L - 3T/a = 0. Its largest real root
+    is taken with the trigonometric/hyperbolic form of the depressed cubic, then nudged by at most
+    one level against the exact integer sums to absorb float rounding.
+    """
+    a, b, c = LEVEL_CURVE_A, LEVEL_CURVE_B, LEVEL_CURVE_C
+    b3 = 3 * (b - a) / (2 * a)
+    c3 = 0.5 - 3 * b / (2 * a) + 3 * c / a
+    p = c3 - b3 ** 2 / 3
+    q = 2 * b3 ** 3 / 27 - b3 * c3 / 3 - 3 * np.asarray(total_xp, dtype=np.float64) / a
+
+    m = 2 * np.sqrt(-p / 3)
+    x = (3 * q / (2 * p)) * np.sqrt(-3 / p)
+    t = np.where(
+        x <= 1,
+        m * np.cos(np.arccos(np.clip(x, -1, 1)) / 3),
+        m * np.cosh(np.arccosh(np.maximum(x, 1)) / 3)
+    )
+
+    total = np.asarray(total_xp, dtype=np.int64)
+    level = np.maximum(np.floor(t - b3 / 3), 0).astype(np.int64)
+    level += total_xp_for_level(level + 1) <= total
+    level -= (level > 0) & (total_xp_for_level(level) > total)
+    return int(level) if level.ndim == 0 else level
+
+# Per-worker rendering assets, filled once by _load_rank_card_assets when a pool thread starts.
+_rank_card_assets = threading.local()
+
+def _load_rank_card_assets(background_path: Path, font_path: Path):
+    background = Image.new("RGBA", (RANK_CARD_WIDTH, RANK_CARD_HEIGHT), (30, 30, 30, 255))
+    if background_path.exists():
+        background = Image.open(background_path).convert("RGBA").resize((RANK_CARD_WIDTH, RANK_CARD_HEIGHT))
+    background.load()
+
+    try:
+        font = ImageFont.truetype(str(font_path), 50)
+        small_font = ImageFont.truetype(str(font_path), 35)
+    except OSError:
+        font = ImageFont.load_default()
+        small_font = ImageFont.load_default()
+        print(f"WARNUNG: Schriftart nicht unter {font_path} gefunden!")
+
+    _rank_card_assets.background = background
+    _rank_card_assets.font = font
+    _rank_card_assets.small_font = small_font
+
+def _render_rank_card(username, avatar_bytes, current_xp, required_xp, level, streak) -> bytes:
+    img = _rank_card_assets.background.copy()
+    draw = ImageDraw.Draw(img)
+
+    avatar = Image.open(io.BytesIO(avatar_bytes)).convert("RGBA").resize((260, 260))
+    img.paste(avatar, (100, RANK_CARD_HEIGHT // 2 - 130), avatar.split()[3])
+
+    draw.text((420, 300), f"{username}", font=_rank_card_assets.font, fill="white")
+    draw.text((420, 370), f"Level {level} | Streak: {streak} Tage", font=_rank_card_assets.small_font, fill=(200, 200, 200))
+
+    bar_x, bar_y, bar_w, bar_h = 420, 450, 600, 500
+    draw.rounded_rectangle((bar_x, 450, bar_x + 600, 500), radius=25, fill=(60, 60, 60))
+
+    progress = min(current_xp / required_xp, 1.0)
+    if progress > 0:
+        draw.rounded_rectangle((bar_x, 450, bar_x + int(600 * progress), 500), radius=25, fill=(120, 190, 255))
+
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+class RankCardRenderer:
+    def __init__(self, background_path: Path, font_path: Path, workers: int = 2, max_concurrent: int = 4):
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix="rank-card",
+            initializer=_load_rank_card_assets,
+            initargs=(background_path, font_path)
+        )
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        # Number of render requests currently waiting for or holding a slot.
+        self.queue_depth = 0
+        self.peak_queue_depth = 0
+
+    def warm_up(self):
+        # Spin up the worker threads now so the first /rank does not pay for loading the assets.
+        for _ in range(self.workers):
+            self.executor.submit(time.sleep, 0.05)
+
+    async def render(self, username, avatar_bytes, current_xp, required_xp, level, streak) -> bytes:
+        self.queue_depth += 1
+        self.peak_queue_depth = max(self.peak_queue_depth, self.queue_depth)
+        try:
+            async with self.semaphore:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self.executor, _render_rank_card, username, avatar_bytes, current_xp, required_xp, level, streak)
+        finally:
+            self.queue_depth -= 1
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
 class LeaderboardView(discord.ui.View):
     def __init__(self, cog, total_users, interaction, embed_color):
         super().__init__(timeout=180)
@@ -57,6 +214,345 @@ class LeaderboardView(discord.ui.View):
         except:
             pass
 
+class GuildRankingSnapshot:
+    """Columnar (user_id, level, xp) view of one guild, sorted ascending by (score, user_id).
+
+    Reading the arrays back to front gives the leaderboard order (level DESC, xp DESC, user_id DESC),
+    so rank lookups are a binary search and pages are plain slices. XP grants only record the new score;
+    the arrays are rebuilt from all pending changes in one pass the next time the order is read.
+    """
+
+    def __init__(self, rows):
+        rows = list(rows)
+        user_ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+        scores = np.fromiter((self.score(r[2], r[1]) for r in rows), dtype=np.int64, count=len(rows))
+        order = np.lexsort((user_ids, scores))
+        self.user_ids = user_ids[order]
+        self.scores = scores[order]
+        self.user_scores = dict(zip(self.user_ids.tolist(), self.scores.tolist()))
+        # user_id -> score before its first pending change (None for users not in the arrays yet).
+        self.pending = {}
+
+    @staticmethod
+    def score(level, xp):
+        return (level << 32) | xp
+
+    @staticmethod
+    def unpack(score):
+        return score >> 32, score & 0xFFFFFFFF
+
+    def level_of(self, user_id):
+        score = self.user_scores.get(user_id)
+        return self.unpack(score)[0] if score is not None else 0
+
+    def __len__(self):
+        self._apply_pending()
+        return len(self.user_ids)
+
+    def _index(self, user_id, score):
+        lo = np.searchsorted(self.scores, score, side="left")
+        hi = np.searchsorted(self.scores, score, side="right")
+        return int(lo + np.searchsorted(self.user_ids[lo:hi], user_id))
+
+    def update(self, user_id, level, xp):
+        score = self.score(level, xp)
+        old_score = self.user_scores.get(user_id)
+        if old_score == score:
+            return
+        self.pending.setdefault(user_id, old_score)
+        self.user_scores[user_id] = score
+
+    def _apply_pending(self):
+        if not self.pending:
+            return
+        changes, self.pending = self.pending, {}
+
+        # Drop the stale entries of every changed user with one mask ...
+        stale = [self._index(user_id, old_score) for user_id, old_score in changes.items() if old_score is not None]
+        if stale:
+            keep = np.ones(len(self.user_ids), dtype=bool)
+            keep[stale] = False
+            self.user_ids = self.user_ids[keep]
+            self.scores = self.scores[keep]
+
+        # ... and insert the new ones, in (score, user_id) order, with a single copy.
+        new_user_ids = np.fromiter(changes.keys(), dtype=np.int64, count=len(changes))
+        new_scores = np.fromiter((self.user_scores[user_id] for user_id in changes), dtype=np.int64, count=len(changes))
+        order = np.lexsort((new_user_ids, new_scores))
+        new_user_ids, new_scores = new_user_ids[order], new_scores[order]
+        positions = [self._index(user_id, score) for user_id, score in zip(new_user_ids.tolist(), new_scores.tolist())]
+        self.user_ids = np.insert(self.user_ids, positions, new_user_ids)
+        self.scores = np.insert(self.scores, positions, new_scores)
+
+    def rank_of(self, user_id):
+        self._apply_pending()
+        score = self.user_scores.get(user_id)
+        if score is None:
+            return None
+        return len(self) - self._index(user_id, score)
+
+    def percentile(self, user_id):
+        # Share of the guild ranked below this user.
+        rank = self.rank_of(user_id)
+        if rank is None:
+            return None
+        return (len(self) - rank) / len(self) * 100
+
+    def page(self, offset, limit):
+        self._apply_pending()
+        end = len(self) - offset
+        start = max(end - limit, 0)
+        if end <= 0:
+            return []
+        rows = []
+        for user_id, score in zip(self.user_ids[start:end][::-1].tolist(), self.scores[start:end][::-1].tolist()):
+            level, xp = self.unpack(score)
+            rows.append((user_id, xp, level))
+        return rows
+
+    def neighbours(self, user_id, count=1):
+        rank = self.rank_of(user_id)
+        if rank is None:
+            return [], []
+        above = self.page(max(rank - 1 - count, 0), min(count, rank - 1))
+        below = self.page(rank, count)
+        return above, below
+
+class RankCardCache:
+    def __init__(self, max_entries: int = 256, disk_dir: Path | None = None, max_disk_entries: int = 2000):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.max_disk_entries = max_disk_entries
+        self.entries = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._disk_writes = 0
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+
+    def _disk_path(self, key) -> Path:
+        return self.disk_dir / f"{hashlib.sha256(repr(key).encode('utf-8')).hexdigest()}.png"
+
+    def _remember(self, key, card: bytes):
+        self.entries[key] = card
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def get(self, key) -> bytes | None:
+        card = self.entries.get(key)
+        if card is not None:
+            self.entries.move_to_end(key)
+            self.memory_hits += 1
+            return card
+
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                card = await asyncio.to_thread(path.read_bytes)
+            except OSError:
+                card = None
+            if card is not None:
+                self._remember(key, card)
+                self.disk_hits += 1
+                return card
+
+        self.misses += 1
+        return None
+
+    async def put(self, key, card: bytes):
+        self._remember(key, card)
+        if not self.disk_dir:
+            return
+
+        try:
+            await asyncio.to_thread(self._disk_path(key).write_bytes, card)
+            self._disk_writes += 1
+            if self._disk_writes % 100 == 0:
+                await asyncio.to_thread(self._prune_disk)
+        except OSError as e:
+            print(f"Fehler beim Speichern der Rangkarte im Cache: {e}")
+
+    def _prune_disk(self):
+        files = sorted(self.disk_dir.glob("*.png"), key=lambda f: f.stat().st_mtime, reverse=True)
+        for stale in files[self.max_disk_entries:]:
+            stale.unlink(missing_ok=True)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.memory_hits + self.disk_hits + self.misses
+        return (self.memory_hits + self.disk_hits) / total if total else 0.0
+
+class LevelRoleQueue:
+    """Applies level roles in the background, one member.edit() per member.
+
+    Each guild has its own worker and sliding-window rate limit, so a backlog in one guild
+    never delays another. Queuing a member who is already pending only updates the target level.
+    """
+
+    def __init__(self, bot, edits_per_window: int = 5, window_seconds: float = 5.0):
+        self.bot = bot
+        self.edits_per_window = edits_per_window
+        self.window_seconds = window_seconds
+        self.pending = {}
+        self.workers = {}
+        self.recent_edits = {}
+        self.applied = 0
+
+    def enqueue(self, guild_id, member_id, level):
+        self.pending.setdefault(guild_id, OrderedDict())[member_id] = level
+        worker = self.workers.get(guild_id)
+        if worker is None or worker.done():
+            self.workers[guild_id] = asyncio.create_task(self._run_guild(guild_id))
+
+    def remaining(self, guild_id):
+        return len(self.pending.get(guild_id, ()))
+
+    @staticmethod
+    def level_role_ids(config):
+        return {100: config.lvl100, 50: config.lvl50, 25: config.lvl25, 10: config.lvl10}
+
+    async def _wait_for_slot(self, guild_id):
+        edits = self.recent_edits.setdefault(guild_id, deque())
+        now = time.monotonic()
+        while edits and now - edits[0] >= self.window_seconds:
+            edits.popleft()
+        if len(edits) >= self.edits_per_window:
+            await asyncio.sleep(self.window_seconds - (now - edits[0]))
+            edits.popleft()
+        edits.append(time.monotonic())
+
+    async def _run_guild(self, guild_id):
+        pending = self.pending[guild_id]
+        while pending:
+            member_id, level = pending.popitem(last=False)
+            try:
+                await self._apply(guild_id, member_id, level)
+            except discord.HTTPException as e:
+                print(f"Fehler beim Setzen der Levelrolle für {member_id}: {e}")
+
+    async def _apply(self, guild_id, member_id, level):
+        guild = self.bot.get_guild(guild_id)
+        config = channels.get_config(guild_id)
+        if not guild or not config or not guild.me.guild_permissions.manage_roles:
+            return
+        member = guild.get_member(member_id)
+        if not member:
+            return
+
+        server_roles = self.level_role_ids(config)
+        all_role_ids = {r_id for r_id in server_roles.values() if r_id}
+
+        target_role = None
+        for lvl in sorted(server_roles.keys(), reverse=True):
+            if level >= lvl and server_roles[lvl]:
+                target_role = guild.get_role(server_roles[lvl])
+                break
+
+        new_roles = [role for role in member.roles if not role.is_default() and role.id not in all_role_ids]
+        if target_role:
+            new_roles.append(target_role)
+
+        if {role.id for role in new_roles} == {role.id for role in member.roles if not role.is_default()}:
+            return
+
+        await self._wait_for_slot(guild_id)
+        await member.edit(roles=new_roles, reason=f"Levelrolle für Level {level} aktualisiert")
+        self.applied += 1
+
+    def close(self):
+        for worker in self.workers.values():
+            worker.cancel()
+
+class AnnouncementDispatcher:
+    """Batches announcement embeds per channel into messages of up to 10 embeds.
+
+    Embeds queued within window_seconds go out together. When a channel has used up its
+    messages_per_minute budget, everything pending for it is folded into a single summary embed.
+    """
+
+    MAX_EMBEDS_PER_MESSAGE = 10
+
+    def __init__(self, bot, window_seconds: float = 3.0, messages_per_minute: int = 5):
+        self.bot = bot
+        self.window_seconds = window_seconds
+        self.messages_per_minute = messages_per_minute
+        self.pending = {}
+        self.workers = {}
+        self.recent_sends = {}
+
+    def announce(self, channel, embed: discord.Embed):
+        self.pending.setdefault(channel.id, []).append(embed)
+        worker = self.workers.get(channel.id)
+        if worker is None or worker.done():
+            self.workers[channel.id] = asyncio.create_task(self._run_channel(channel.id))
+
+    def _available(self, channel_id):
+        sends = self.recent_sends.setdefault(channel_id, deque())
+        now = time.monotonic()
+        while sends and now - sends[0] >= 60:
+            sends.popleft()
+        return self.messages_per_minute - len(sends)
+
+    async def _wait_for_slot(self, channel_id):
+        if self._available(channel_id) <= 0:
+            sends = self.recent_sends[channel_id]
+            await asyncio.sleep(60 - (time.monotonic() - sends[0]))
+            sends.popleft()
+        self.recent_sends[channel_id].append(time.monotonic())
+
+    @staticmethod
+    def _aggregate(embeds):
+        lines = [embed.description for embed in embeds if embed.description]
+        description = ""
+        for index, line in enumerate(lines):
+            if len(description) + len(line) + 60 > 4096:
+                description += f"... und {len(lines) - index} weitere"
+                break
+            description += line + "\n"
+        return discord.Embed(title="📣 Neuigkeiten", description=description, color=discord.Color.dark_red())
+
+    async def _run_channel(self, channel_id):
+        await asyncio.sleep(self.window_seconds)
+        while self.pending.get(channel_id):
+            embeds = self.pending.pop(channel_id)
+            channel = self.bot.get_channel(channel_id)
+            if channel is None:
+                return
+
+            batches = [embeds[i:i + self.MAX_EMBEDS_PER_MESSAGE] for i in range(0, len(embeds), self.MAX_EMBEDS_PER_MESSAGE)]
+            if len(batches) > max(self._available(channel_id), 1):
+                batches = [[self._aggregate(embeds)]]
+
+            for batch in batches:
+                await self._wait_for_slot(channel_id)
+                try:
+                    await channel.send(embeds=batch)
+                except discord.HTTPException:
+                    pass
+
+    def close(self):
+        for worker in self.workers.values():
+            worker.cancel()
+
+class UserLevelState:
+    def __init__(self, xp, level, daily_messages, daily_voice_minutes, last_update_day, current_streak, last_streak_day, activity_days=None):
+        self.xp = xp
+        self.level = level
+        self.daily_messages = daily_messages
+        self.daily_voice_minutes = daily_voice_minutes
+        # Day values are date.toordinal() integers.
+        self.last_update_day = last_update_day
+        self.current_streak = current_streak
+        self.last_streak_day = last_streak_day
+        # Bitmap of active days, see ACTIVITY_EPOCH_DAY.
+        self.activity = activity_from_blob(activity_days)
+        # Voice seconds not yet worth a full minute; carried into the next credit.
+        self.voice_seconds = 0.0
+        # Day this entry was last read through _get_user_state; decides cache eviction at rollover.
+        self.touched_day = None
+
 class Leveling(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
@@ -70,16 +566,63 @@ class Leveling(commands.Cog):
         self.MAX_VOICE_MINUTES_PER_DAY = 180
         self.STREAK_XP_BONUS_MULTIPLIER = 10
 
+        # Per-user token bucket for message XP: one grant every XP_COOLDOWN_SECONDS, up to XP_COOLDOWN_BURST at once.
+        self.XP_COOLDOWN_SECONDS = 60
+        self.XP_COOLDOWN_BURST = 3
+        self.xp_buckets = {}
+
         self.data_base_path = Path(__file__).parent.parent / "data"
         self.RANK_CARD_BACKGROUND_PATH = self.data_base_path / "rank_card_background.png"
         self.FONT_PATH = self.data_base_path / "arial.ttf"
 
+        self.RANK_CARD_WORKERS = 2
+        self.RANK_CARD_MAX_CONCURRENT = 4
+        self.rank_card_renderer = RankCardRenderer(self.RANK_CARD_BACKGROUND_PATH, self.FONT_PATH, self.RANK_CARD_WORKERS, self.RANK_CARD_MAX_CONCURRENT)
+
+        # Progress is rounded to this many steps so small XP changes reuse the cached card.
+        self.RANK_CARD_PROGRESS_BUCKETS = 50
+        self.RANK_CARD_CACHE_SIZE = 256
+        self.rank_card_cache = RankCardCache(self.RANK_CARD_CACHE_SIZE, self.data_base_path / "rank_cards")
+
+        # Write-behind buffer: authoritative per-user state lives here and is
+        # flushed to levels.db in batches by flush_xp_task.
+        self.XP_FLUSH_INTERVAL_SECONDS = 5
+        self.XP_FLUSH_MAX_PENDING = 100
+        self.xp_cache = {}
+        self.dirty_xp_keys = set()
+        self.xp_flush_lock = asyncio.Lock()
+        # guild_id -> GuildRankingSnapshot, loaded on first use and kept in sync by the XP write path.
+        self.ranking_snapshots = {}
+
+        # Active voice sessions: (guild_id, user_id) -> monotonic time of the last credit.
+        self.voice_sessions = {}
+
+        # Append-only XP ledger: events are written with the XP buffer and rolled up by compact_xp_ledger_task.
+        self.XP_EVENT_RETENTION_DAYS = 7
+        self.XP_HOURLY_RETENTION_DAYS = 30
+        self.pending_xp_events = []
+
+        self.level_role_queue = LevelRoleQueue(bot)
+        self.announcements = AnnouncementDispatcher(bot)
+
+        # Ordinal of the day the daily counters belong to; advanced by daily_rollover_task.
+        self.current_day = date.today().toordinal()
+
+        self.flush_xp_task.change_interval(seconds=self.XP_FLUSH_INTERVAL_SECONDS)
+        self.flush_xp_task.start()
         self.voice_xp_task.start()
+        self.daily_rollover_task.start()
+        self.compact_xp_ledger_task.start()
 
     async def cog_load(self):
         await self.setup_db()
+        self.rank_card_renderer.warm_up()
+        self.bot.message_router.register("leveling", self.handle_message)
 
     async def setup_db(self):
+        async with self.db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'levels'") as cursor:
+            table_exists = await cursor.fetchone() is not None
+
         await self.db.execute("""
                               CREATE TABLE IF NOT EXISTS levels (
                                                                     guild_id INTEGER NOT NULL,
@@ -88,79 +631,226 @@ class Leveling(commands.Cog):
                                                                     level INTEGER DEFAULT 0,
                                                                     daily_messages INTEGER DEFAULT 0,
                                                                     daily_voice_minutes INTEGER DEFAULT 0,
-                                                                    last_update_date TEXT,
+                                                                    last_update_day INTEGER,
                                                                     current_streak INTEGER DEFAULT 0,
-                                                                    last_streak_date TEXT,
+                                                                    last_streak_day INTEGER,
+                                                                    activity_days BLOB,
                                                                     PRIMARY KEY (guild_id, user_id)
                               )
                               """)
+        await self.db.execute("CREATE INDEX IF NOT EXISTS idx_levels_ranking ON levels (guild_id, level, xp, user_id)")
+        await self.db.execute("""
+                              CREATE TABLE IF NOT EXISTS xp_events (
+                                                                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                                                    guild_id INTEGER NOT NULL,
+                                                                    user_id INTEGER NOT NULL,
+                                                                    created_at INTEGER NOT NULL,
+                                                                    source INTEGER NOT NULL,
+                                                                    amount INTEGER NOT NULL
+                              )
+                              """)
+        await self.db.execute("CREATE INDEX IF NOT EXISTS idx_xp_events_created ON xp_events (created_at)")
+        await self.db.execute("""
+                              CREATE TABLE IF NOT EXISTS xp_hourly (
+                                                                    guild_id INTEGER NOT NULL,
+                                                                    hour INTEGER NOT NULL,
+                                                                    user_id INTEGER NOT NULL,
+                                                                    xp INTEGER DEFAULT 0,
+                                                                    PRIMARY KEY (guild_id, hour, user_id)
+                              )
+                              """)
+        # xp_daily.day is a local date ordinal, the same day boundary as last_update_day.
+        await self.db.execute("""
+                              CREATE TABLE IF NOT EXISTS xp_daily (
+                                                                    guild_id INTEGER NOT NULL,
+                                                                    day INTEGER NOT NULL,
+                                                                    user_id INTEGER NOT NULL,
+                                                                    xp INTEGER DEFAULT 0,
+                                                                    PRIMARY KEY (guild_id, day, user_id)
+                              )
+                              """)
+        await self.db.execute("""
+                              CREATE TABLE IF NOT EXISTS xp_ledger_meta (
+                                                                    name TEXT PRIMARY KEY,
+                                                                    value INTEGER
+                              )
+                              """)
+        if table_exists:
+            await self._migrate_db()
+        await self.db.execute(f"PRAGMA user_version = {LEVELS_SCHEMA_VERSION}")
         await self.db.commit()
 
-    def xp_needed_for_level(self, level):
-        return 5 * (level ** 2) + (50 * level) + 100
-
-    def get_xp_multiplier(self):
-        return 2 if datetime.now().weekday() >= 5 else 1
-
-    async def _get_user_data_and_reset_daily_limits(self, guild_id, user_id):
-        today = datetime.now().strftime('%Y-%m-%d')
-        yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
-
-        async with self.db.execute("""
-                                   SELECT xp, level, daily_messages, daily_voice_minutes, last_update_date, current_streak, last_streak_date
-                                   FROM levels WHERE guild_id = ? AND user_id = ?
-                                   """, (guild_id, user_id)) as cursor:
-            row = await cursor.fetchone()
-
-        if not row:
+        # Catch up on any midnight that passed while the bot was offline.
+        await self._run_daily_rollover(self.current_day)
+
+    async def _migrate_db(self):
+        async with self.db.execute("PRAGMA user_version") as cursor:
+            version = (await cursor.fetchone())[0]
+
+        if version < 1:
+            # Version 1: xp holds lifetime XP instead of XP into the current level.
+            async with self.db.execute("SELECT guild_id, user_id, xp, level FROM levels") as cursor:
+                rows = await cursor.fetchall()
+            if rows:
+                data = np.array(rows, dtype=np.int64)
+                total_xp = total_xp_for_level(data[:, 3]) + data[:, 2]
+                levels = level_for_total_xp(total_xp)
+                await self.db.executemany(
+                    "UPDATE levels SET xp = ?, level = ? WHERE guild_id = ? AND user_id = ?",
+                    zip(total_xp.tolist(), levels.tolist(), data[:, 0].tolist(), data[:, 1].tolist())
+                )
+                print(f"✅ {len(rows)} Level-Einträge auf Gesamt-XP migriert.")
+
+        if version < 2:
+            # Version 2: day columns hold date ordinals instead of 'YYYY-MM-DD' strings.
+            # The old TEXT columns stay in place but are no longer read or written.
+            await self.db.execute("ALTER TABLE levels ADD COLUMN last_update_day INTEGER")
+            await self.db.execute("ALTER TABLE levels ADD COLUMN last_streak_day INTEGER")
             await self.db.execute("""
-                                  INSERT INTO levels (guild_id, user_id, last_update_date, current_streak, last_streak_date)
-                                  VALUES (?, ?, ?, 0, ?)
-                                  """, (guild_id, user_id, today, yesterday))
-            return 0, 0, 0, 0, 0, yesterday
-
-        xp, level, daily_messages, daily_voice_minutes, last_update_date, current_streak, last_streak_date = row
-        if last_update_date != today:
-            daily_messages, daily_voice_minutes = 0, 0
+                                  UPDATE levels SET
+                                      last_update_day = CAST(julianday(last_update_date) - 1721424.5 AS INTEGER),
+                                      last_streak_day = CAST(julianday(last_streak_date) - 1721424.5 AS INTEGER)
+                                  """)
+
+        if version < 3:
+            # Version 3: activity bitmap, seeded with the days of each user's current streak.
+            await self.db.execute("ALTER TABLE levels ADD COLUMN activity_days BLOB")
+            async with self.db.execute("SELECT guild_id, user_id, current_streak, last_streak_day FROM levels WHERE current_streak > 0 AND last_streak_day IS NOT NULL") as cursor:
+                rows = await cursor.fetchall()
+            updates = []
+            for guild_id, user_id, streak, last_streak_day in rows:
+                end = last_streak_day - ACTIVITY_EPOCH_DAY
+                start = max(end - streak + 1, 0)
+                if end >= 0:
+                    updates.append((activity_to_blob(((1 << (end - start + 1)) - 1) << start), guild_id, user_id))
+            await self.db.executemany("UPDATE levels SET activity_days = ? WHERE guild_id = ? AND user_id = ?", updates)
+
+    def _take_xp_token(self, key):
+        now = time.monotonic()
+        tokens, last = self.xp_buckets.get(key, (self.XP_COOLDOWN_BURST, now))
+        tokens = min(self.XP_COOLDOWN_BURST, tokens + (now - last) / self.XP_COOLDOWN_SECONDS)
+        if tokens < 1:
+            self.xp_buckets[key] = (tokens, now)
+            return False
+        self.xp_buckets[key] = (tokens - 1, now)
+        return True
+
+    def _prune_xp_buckets(self):
+        # A bucket that has refilled completely behaves exactly like a missing one.
+        now = time.monotonic()
+        full_after = self.XP_COOLDOWN_BURST * self.XP_COOLDOWN_SECONDS
+        self.xp_buckets = {key: bucket for key, bucket in self.xp_buckets.items() if now - bucket[1] < full_after}
+
+    async def _run_daily_rollover(self, today):
+        async with self.xp_flush_lock:
+            self.current_day = today
+            # Drop users that were idle the whole previous day. Dirty entries and open voice sessions stay,
+            # so nothing unflushed is lost and voice credits keep their state.
+            self.xp_cache = {
+                key: state for key, state in self.xp_cache.items()
+                if key in self.dirty_xp_keys or key in self.voice_sessions
+                or (state.touched_day is not None and state.touched_day >= today - 1)
+            }
+            for state in self.xp_cache.values():
+                if state.last_update_day != today:
+                    state.daily_messages, state.daily_voice_minutes = 0, 0
+                    state.last_update_day = today
+                if state.last_streak_day is None or state.last_streak_day < today - 1:
+                    state.current_streak = 0
+
+            # Rows in the cache that are still dirty are rewritten by the next flush anyway.
             await self.db.execute("""
-                                  UPDATE levels SET daily_messages = 0, daily_voice_minutes = 0, last_update_date = ?
-                                  WHERE guild_id = ? AND user_id = ?
-                                  """, (today, guild_id, user_id))
-
-        return xp, level, daily_messages, daily_voice_minutes, current_streak, last_streak_date
-
-    async def _check_and_assign_level_role(self, member: discord.Member, new_level: int):
-        config = channels.get_config(member.guild.id)
-        if not config or not member.guild.me.guild_permissions.manage_roles:
-            return
+                                  UPDATE levels SET daily_messages = 0, daily_voice_minutes = 0, last_update_day = ?
+                                  WHERE last_update_day IS NOT ?
+                                  """, (today, today))
+            await self.db.execute("""
+                                  UPDATE levels SET current_streak = 0
+                                  WHERE current_streak != 0 AND (last_streak_day IS NULL OR last_streak_day < ?)
+                                  """, (today - 1,))
+            await self.db.commit()
 
-        server_roles = {
-            100: config.lvl100,
-            50: config.lvl50,
-            25: config.lvl25,
-            10: config.lvl10
-        }
-        all_role_ids = [r_id for r_id in server_roles.values() if r_id]
+    @tasks.loop(seconds=30)
+    async def daily_rollover_task(self):
+        today = date.today().toordinal()
+        if today != self.current_day:
+            await self._run_daily_rollover(today)
+            self._prune_xp_buckets()
 
-        target_role_id = None
-        for lvl in sorted(server_roles.keys(), reverse=True):
-            if new_level >= lvl and server_roles[lvl]:
-                target_role_id = server_roles[lvl]
-                break
+    def xp_needed_for_level(self, level):
+        return LEVEL_CURVE_A * (level ** 2) + (LEVEL_CURVE_B * level) + LEVEL_CURVE_C
 
-        member_role_ids = {role.id for role in member.roles}
-        roles_to_remove = [member.guild.get_role(rid) for rid in all_role_ids
-                           if rid != target_role_id and rid in member_role_ids]
+    def get_xp_multiplier(self):
+        return 2 if datetime.now().weekday() >= 5 else 1
 
-        if roles_to_remove:
-            await member.remove_roles(*[r for r in roles_to_remove if r], reason="Alte Levelrolle entfernen")
+    async def _get_user_state(self, guild_id, user_id):
+        key = (guild_id, user_id)
+        state = self.xp_cache.get(key)
+        if state is None:
+            async with self.db.execute("""
+                                       SELECT xp, level, daily_messages, daily_voice_minutes, last_update_day, current_streak, last_streak_day, activity_days
+                                       FROM levels WHERE guild_id = ? AND user_id = ?
+                                       """, (guild_id, user_id)) as cursor:
+                row = await cursor.fetchone()
+
+            if row:
+                loaded = UserLevelState(*row)
+            else:
+                loaded = UserLevelState(0, 0, 0, 0, self.current_day, 0, self.current_day - 1)
+
+            # Another handler may have loaded the same user while we awaited the SELECT.
+            state = self.xp_cache.setdefault(key, loaded)
+            if state is loaded and not row:
+                self.dirty_xp_keys.add(key)
+                self._update_ranking_snapshot(guild_id, user_id, state)
+
+        state.touched_day = self.current_day
+        return state
+
+    def _record_xp_event(self, guild_id, user_id, source, amount):
+        if amount:
+            self.pending_xp_events.append((guild_id, user_id, int(time.time()), source, amount))
+
+    async def flush_xp_buffer(self):
+        if (not self.dirty_xp_keys and not self.pending_xp_events) or not self.db:
+            return
 
-        if target_role_id and target_role_id not in member_role_ids:
-            target_role = member.guild.get_role(target_role_id)
-            if target_role:
-                await member.add_roles(target_role, reason=f"Level {new_level} erreicht")
+        async with self.xp_flush_lock:
+            keys, self.dirty_xp_keys = self.dirty_xp_keys, set()
+            events, self.pending_xp_events = self.pending_xp_events, []
+            rows = []
+            for guild_id, user_id in keys:
+                state = self.xp_cache.get((guild_id, user_id))
+                if state is None:
+                    continue
+                rows.append((guild_id, user_id, state.xp, state.level, state.daily_messages, state.daily_voice_minutes,
+                             state.last_update_day, state.current_streak, state.last_streak_day, activity_to_blob(state.activity)))
 
-    async def send_level_up_message(self, member: discord.Member, new_level: int):
+            try:
+                await self.db.executemany("""
+                                          INSERT INTO levels (guild_id, user_id, xp, level, daily_messages, daily_voice_minutes,
+                                                              last_update_day, current_streak, last_streak_day, activity_days)
+                                          VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                              ON CONFLICT(guild_id, user_id) DO UPDATE SET
+                                              xp = excluded.xp, level = excluded.level,
+                                              daily_messages = excluded.daily_messages,
+                                              daily_voice_minutes = excluded.daily_voice_minutes,
+                                              last_update_day = excluded.last_update_day,
+                                              current_streak = excluded.current_streak,
+                                              last_streak_day = excluded.last_streak_day,
+                                              activity_days = excluded.activity_days
+                                          """, rows)
+                await self.db.executemany("""
+                                          INSERT INTO xp_events (guild_id, user_id, created_at, source, amount)
+                                          VALUES (?, ?, ?, ?, ?)
+                                          """, events)
+                await self.db.commit()
+            except BaseException:
+                # Keep the rows pending so the next flush retries them; BaseException so a cancelled flush keeps them too.
+                self.dirty_xp_keys |= keys
+                self.pending_xp_events[:0] = events
+                raise
+
+    def send_level_up_message(self, member: discord.Member, new_level: int):
         config = channels.get_config(member.guild.id)
         if not config or not config.levelup_channel_id:
             return
@@ -173,104 +863,203 @@ class Leveling(commands.Cog):
                 color=discord.Color.dark_red()
             )
             embed.set_thumbnail(url=member.display_avatar.url)
-            try:
-                await channel.send(embed=embed)
-            except:
-                pass
+            self.announcements.announce(channel, embed)
 
-    async def _update_xp_and_counters(self, guild_id, user_id, xp, level, xp_to_add, new_msg_count, new_vc_minutes, new_streak, new_last_streak_date):
+    async def _update_xp_and_counters(self, guild_id, user_id, state, xp_to_add):
         guild = self.bot.get_guild(guild_id)
         member = guild.get_member(user_id) if guild else None
 
-        new_xp = xp + xp_to_add
-        new_level = level
-        level_up = False
+        state.xp += xp_to_add
+        new_level = level_for_total_xp(state.xp)
+        level_up = new_level > state.level
+        state.level = new_level
 
-        while new_xp >= self.xp_needed_for_level(new_level):
-            new_xp -= self.xp_needed_for_level(new_level)
-            new_level += 1
-            level_up = True
-
-        today = datetime.now().strftime('%Y-%m-%d')
-        await self.db.execute("""
-                              UPDATE levels SET xp = ?, level = ?, daily_messages = ?, daily_voice_minutes = ?,
-                                                last_update_date = ?, current_streak = ?, last_streak_date = ?
-                              WHERE guild_id = ? AND user_id = ?
-                              """, (new_xp, new_level, new_msg_count, new_vc_minutes, today, new_streak, new_last_streak_date, guild_id, user_id))
+        self.dirty_xp_keys.add((guild_id, user_id))
+        self._update_ranking_snapshot(guild_id, user_id, state)
+        if len(self.dirty_xp_keys) >= self.XP_FLUSH_MAX_PENDING:
+            await self.flush_xp_buffer()
 
         if level_up and member:
-            await self.send_level_up_message(member, new_level)
-            await self._check_and_assign_level_role(member, new_level)
+            self.send_level_up_message(member, state.level)
+            self.level_role_queue.enqueue(guild_id, user_id, state.level)
 
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
+    async def handle_message(self, message: discord.Message):
         if message.author.bot or not message.guild or not self.db or message.guild.id == EXCLUDED_GUILD_ID:
             return
 
         guild_id, user_id = message.guild.id, message.author.id
-        xp_multiplier = self.get_xp_multiplier()
-        xp, level, daily_messages, daily_voice_minutes, current_streak, last_streak_date = await self._get_user_data_and_reset_daily_limits(guild_id, user_id)
-
-        new_streak, new_last_streak_date, streak_bonus = current_streak, last_streak_date, 0
+        if not self._take_xp_token((guild_id, user_id)):
+            return
 
-        if daily_messages < self.MAX_MESSAGES_PER_DAY:
-            if daily_messages == 0:
-                today_date = datetime.now().date()
-                yesterday = today_date - timedelta(days=1)
-                if last_streak_date is not None:
-                    last_streak_dt = datetime.strptime(last_streak_date, '%Y-%m-%d').date()
-                else:
-                    last_streak_dt = datetime.now().date()
+        xp_multiplier = self.get_xp_multiplier()
+        state = await self._get_user_state(guild_id, user_id)
 
+        streak_bonus = 0
 
-                if last_streak_dt == yesterday:
-                    new_streak += 1
-                elif last_streak_dt < yesterday:
-                    new_streak = 1
-                new_last_streak_date = today_date.strftime('%Y-%m-%d')
+        if state.daily_messages < self.MAX_MESSAGES_PER_DAY:
+            if state.last_streak_day != self.current_day:
+                state.last_streak_day = self.current_day
+                state.activity |= 1 << (self.current_day - ACTIVITY_EPOCH_DAY)
+                state.current_streak = activity_streak(state.activity, self.current_day)
 
-                if new_streak > 1:
+                if state.current_streak > 1:
                     streakembed = discord.Embed(
                         title="🔥 Streak verlängert!",
-                        description=f"{message.author.mention} hat jetzt einen **Streak von {new_streak} Tagen**!",
+                        description=f"{message.author.mention} hat jetzt einen **Streak von {state.current_streak} Tagen**!",
                         color=discord.Color.dark_red()
                     )
                     streakembed.set_thumbnail(url=message.author.display_avatar.url)
-                    await message.channel.send(embed=streakembed)
-                    streak_bonus = new_streak * self.STREAK_XP_BONUS_MULTIPLIER
+                    self.announcements.announce(message.channel, streakembed)
+                    streak_bonus = state.current_streak * self.STREAK_XP_BONUS_MULTIPLIER
 
+            state.daily_messages += 1
             xp_to_add = (self.MESSAGE_XP * xp_multiplier) + streak_bonus
-            await self._update_xp_and_counters(guild_id, user_id, xp, level, xp_to_add, daily_messages + 1, daily_voice_minutes, new_streak, new_last_streak_date)
-            await self.db.commit()
+            self._record_xp_event(guild_id, user_id, XP_SOURCE_MESSAGE, self.MESSAGE_XP)
+            self._record_xp_event(guild_id, user_id, XP_SOURCE_WEEKEND, self.MESSAGE_XP * (xp_multiplier - 1))
+            self._record_xp_event(guild_id, user_id, XP_SOURCE_STREAK, streak_bonus)
+            await self._update_xp_and_counters(guild_id, user_id, state, xp_to_add)
+
+    def _is_earning_voice(self, voice_state):
+        return voice_state is not None and voice_state.channel is not None and not voice_state.self_mute
+
+    async def _credit_voice_session(self, guild_id, user_id, now, end_session=False):
+        key = (guild_id, user_id)
+        started = self.voice_sessions.pop(key, None) if end_session else self.voice_sessions.get(key)
+        if started is None:
+            return
+        if not end_session:
+            self.voice_sessions[key] = now
 
-    @tasks.loop(minutes=1)
-    async def voice_xp_task(self):
-        if not self.db or not self.bot.is_ready():
+        state = await self._get_user_state(guild_id, user_id)
+        minutes, state.voice_seconds = divmod(state.voice_seconds + (now - started), 60)
+        minutes = min(int(minutes), self.MAX_VOICE_MINUTES_PER_DAY - state.daily_voice_minutes)
+        if minutes <= 0:
             return
 
+        state.daily_voice_minutes += minutes
+        voice_xp = minutes * self.VOICE_XP_PER_MINUTE
         xp_multiplier = self.get_xp_multiplier()
+        self._record_xp_event(guild_id, user_id, XP_SOURCE_VOICE, voice_xp)
+        self._record_xp_event(guild_id, user_id, XP_SOURCE_WEEKEND, voice_xp * (xp_multiplier - 1))
+        await self._update_xp_and_counters(guild_id, user_id, state, voice_xp * xp_multiplier)
+
+    def _sync_voice_sessions(self):
+        now = time.monotonic()
         for guild in self.bot.guilds:
-            # Skip the excluded guild in the loop
             if guild.id == EXCLUDED_GUILD_ID:
                 continue
+            for channel in [*guild.voice_channels, *guild.stage_channels]:
+                for member in channel.members:
+                    if not member.bot and self._is_earning_voice(member.voice):
+                        self.voice_sessions.setdefault((guild.id, member.id), now)
 
-            for member in guild.members:
-                if member.voice and member.voice.channel and not member.bot and not member.voice.self_mute:
-                    xp, level, dm, dvm, streak, lsd = await self._get_user_data_and_reset_daily_limits(guild.id, member.id)
-                    if dvm < self.MAX_VOICE_MINUTES_PER_DAY:
-                        await self._update_xp_and_counters(guild.id, member.id, xp, level, self.VOICE_XP_PER_MINUTE * xp_multiplier, dm, dvm + 1, streak, lsd)
-        await self.db.commit()
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # Also fires after a reconnect that could not resume, when join events may have been missed.
+        self._sync_voice_sessions()
+
+    @commands.Cog.listener()
+    async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
+        if member.bot or member.guild.id == EXCLUDED_GUILD_ID:
+            return
+
+        key = (member.guild.id, member.id)
+        earning = self._is_earning_voice(after)
+        if key in self.voice_sessions and not earning:
+            await self._credit_voice_session(member.guild.id, member.id, time.monotonic(), end_session=True)
+        elif key not in self.voice_sessions and earning:
+            self.voice_sessions[key] = time.monotonic()
+
+    @tasks.loop(minutes=1)
+    async def voice_xp_task(self):
+        if not self.db or not self.bot.is_ready():
+            return
+
+        # Checkpoint every open session; members who are not in voice cost nothing here. A session whose leave
+        # event was missed (e.g. across a gateway reconnect) is ended here instead of earning XP for good.
+        now = time.monotonic()
+        for guild_id, user_id in list(self.voice_sessions):
+            guild = self.bot.get_guild(guild_id)
+            member = guild.get_member(user_id) if guild else None
+            still_earning = member is not None and self._is_earning_voice(member.voice)
+            await self._credit_voice_session(guild_id, user_id, now, end_session=not still_earning)
+        await self.flush_xp_buffer()
 
     @voice_xp_task.before_loop
     async def before_voice_xp_task(self):
         await self.bot.wait_until_ready()
+        self._sync_voice_sessions()
+
+    @tasks.loop(seconds=5)
+    async def flush_xp_task(self):
+        try:
+            await self.flush_xp_buffer()
+        except Exception as e:
+            print(f"Fehler beim Speichern der XP-Daten: {e}")
+
+    async def compact_xp_ledger(self):
+        await self.flush_xp_buffer()
+        async with self.xp_flush_lock:
+            async with self.db.execute("SELECT value FROM xp_ledger_meta WHERE name = 'rolled_up_id'") as cursor:
+                row = await cursor.fetchone()
+            rolled_up_id = row[0] if row else 0
+            async with self.db.execute("SELECT COALESCE(MAX(id), 0) FROM xp_events") as cursor:
+                max_id = (await cursor.fetchone())[0]
+
+            if max_id > rolled_up_id:
+                await self.db.execute("""
+                                      INSERT INTO xp_hourly (guild_id, hour, user_id, xp)
+                                      SELECT guild_id, created_at / 3600, user_id, SUM(amount) FROM xp_events
+                                      WHERE id > ? AND id <= ? GROUP BY guild_id, created_at / 3600, user_id
+                                      ON CONFLICT(guild_id, hour, user_id) DO UPDATE SET xp = xp + excluded.xp
+                                      """, (rolled_up_id, max_id))
+                await self.db.execute("""
+                                      INSERT INTO xp_daily (guild_id, day, user_id, xp)
+                                      SELECT guild_id, CAST(julianday(created_at, 'unixepoch', 'localtime') - 1721424.5 AS INTEGER) AS day, user_id, SUM(amount)
+                                      FROM xp_events
+                                      WHERE id > ? AND id <= ? GROUP BY guild_id, day, user_id
+                                      ON CONFLICT(guild_id, day, user_id) DO UPDATE SET xp = xp + excluded.xp
+                                      """, (rolled_up_id, max_id))
+                await self.db.execute("INSERT OR REPLACE INTO xp_ledger_meta (name, value) VALUES ('rolled_up_id', ?)", (max_id,))
+
+            now = int(time.time())
+            await self.db.execute("DELETE FROM xp_events WHERE created_at < ? AND id <= ?", (now - self.XP_EVENT_RETENTION_DAYS * 86400, max_id))
+            await self.db.execute("DELETE FROM xp_hourly WHERE hour < ?", ((now - self.XP_HOURLY_RETENTION_DAYS * 86400) // 3600,))
+            await self.db.commit()
+
+    @tasks.loop(minutes=5)
+    async def compact_xp_ledger_task(self):
+        try:
+            await self.compact_xp_ledger()
+        except Exception as e:
+            print(f"Fehler beim Verdichten des XP-Verlaufs: {e}")
+
+    @compact_xp_ledger_task.before_loop
+    async def before_compact_xp_ledger_task(self):
+        await self.bot.wait_until_ready()
+
+    def _update_ranking_snapshot(self, guild_id, user_id, state):
+        snapshot = self.ranking_snapshots.get(guild_id)
+        if snapshot is not None:
+            snapshot.update(user_id, state.level, state.xp)
+
+    async def _get_ranking_snapshot(self, guild_id):
+        snapshot = self.ranking_snapshots.get(guild_id)
+        if snapshot is None:
+            await self.flush_xp_buffer()
+            async with self.db.execute("SELECT user_id, xp, level FROM levels WHERE guild_id = ?", (guild_id,)) as cursor:
+                loaded = GuildRankingSnapshot(await cursor.fetchall())
+            snapshot = self.ranking_snapshots.setdefault(guild_id, loaded)
+            if snapshot is loaded:
+                # Apply anything the write path changed while the SELECT was running.
+                for (g_id, u_id), state in self.xp_cache.items():
+                    if g_id == guild_id:
+                        snapshot.update(u_id, state.level, state.xp)
+        return snapshot
 
     async def _create_leaderboard_embed(self, guild, offset, limit, total_users):
-        async with self.db.execute("""
-                                   SELECT user_id, xp, level FROM levels WHERE guild_id = ?
-                                   ORDER BY level DESC, xp DESC LIMIT ? OFFSET ?
-                                   """, (guild.id, limit, offset)) as cursor:
-            top_users = await cursor.fetchall()
+        snapshot = await self._get_ranking_snapshot(guild.id)
+        top_users = snapshot.page(offset, limit)
 
         leaderboard_msg = ""
         for index, (u_id, u_xp, u_lvl) in enumerate(top_users):
@@ -288,8 +1077,7 @@ class Leveling(commands.Cog):
             return await interaction.response.send_message("Das Level-System ist auf diesem Server deaktiviert.", ephemeral=True)
 
         await interaction.response.defer()
-        async with self.db.execute("SELECT COUNT(*) FROM levels WHERE guild_id = ?", (interaction.guild_id,)) as cursor:
-            total = (await cursor.fetchone())[0]
+        total = len(await self._get_ranking_snapshot(interaction.guild_id))
 
         if total == 0:
             return await interaction.followup.send("Noch keine Daten vorhanden.")
@@ -298,39 +1086,8 @@ class Leveling(commands.Cog):
         await interaction.followup.send(embed=embed, view=LeaderboardView(self, total, interaction, discord.Color.dark_red()))
 
     async def _create_rank_card(self, username, avatar_bytes, current_xp, required_xp, level, streak):
-        WIDTH, HEIGHT = 1278, 852
-        img = Image.new("RGBA", (WIDTH, HEIGHT), (30, 30, 30, 255))
-
-        if self.RANK_CARD_BACKGROUND_PATH.exists():
-            img = Image.open(self.RANK_CARD_BACKGROUND_PATH).convert("RGBA").resize((WIDTH, HEIGHT))
-
-        draw = ImageDraw.Draw(img)
-
-        avatar = Image.open(io.BytesIO(avatar_bytes)).convert("RGBA").resize((260, 260))
-        img.paste(avatar, (100, HEIGHT // 2 - 130), avatar.split()[3])
-
-        try:
-            font = ImageFont.truetype(str(self.FONT_PATH), 50)
-            small_font = ImageFont.truetype(str(self.FONT_PATH), 35)
-        except OSError:
-            font = ImageFont.load_default()
-            small_font = ImageFont.load_default()
-            print(f"WARNUNG: Schriftart nicht unter {self.FONT_PATH} gefunden!")
-
-        draw.text((420, 300), f"{username}", font=font, fill="white")
-        draw.text((420, 370), f"Level {level} | Streak: {streak} Tage", font=small_font, fill=(200, 200, 200))
-
-        bar_x, bar_y, bar_w, bar_h = 420, 450, 600, 500
-        draw.rounded_rectangle((bar_x, 450, bar_x + 600, 500), radius=25, fill=(60, 60, 60))
-
-        progress = min(current_xp / required_xp, 1.0)
-        if progress > 0:
-            draw.rounded_rectangle((bar_x, 450, bar_x + int(600 * progress), 500), radius=25, fill=(120, 190, 255))
-
-        buf = io.BytesIO()
-        img.save(buf, format="PNG")
-        buf.seek(0)
-        return buf
+        card = await self.rank_card_renderer.render(username, avatar_bytes, current_xp, required_xp, level, streak)
+        return io.BytesIO(card)
 
     @discord.app_commands.command(name="rank", description="Zeigt deinen Level-Fortschritt an.")
     async def rank_command(self, interaction: discord.Interaction, member: discord.Member = None):
@@ -339,13 +1096,128 @@ class Leveling(commands.Cog):
 
         await interaction.response.defer()
         user = member or interaction.user
-        xp, lvl, dm, dvm, streak, lsd = await self._get_user_data_and_reset_daily_limits(interaction.guild_id, user.id)
+        state = await self._get_user_state(interaction.guild_id, user.id)
+
+        progress = min((state.xp - total_xp_for_level(state.level)) / self.xp_needed_for_level(state.level), 1.0)
+        progress_bucket = int(progress * self.RANK_CARD_PROGRESS_BUCKETS)
+        cache_key = (user.display_name, user.display_avatar.key, state.level, progress_bucket, state.current_streak)
+
+        card_bytes = await self.rank_card_cache.get(cache_key)
+        if card_bytes is None:
+            card = await self._create_rank_card(user.display_name, await user.display_avatar.read(), progress_bucket, self.RANK_CARD_PROGRESS_BUCKETS, state.level, state.current_streak)
+            card_bytes = card.getvalue()
+            await self.rank_card_cache.put(cache_key, card_bytes)
+
+        snapshot = await self._get_ranking_snapshot(interaction.guild_id)
+        rank_info = []
+        rank = snapshot.rank_of(user.id)
+        if rank is not None:
+            rank_info.append(f"📊 Rang **#{rank}** von {len(snapshot)} (besser als {snapshot.percentile(user.id):.1f}% der Mitglieder)")
+            above, below = snapshot.neighbours(user.id)
+            neighbour_names = []
+            for label, rows in (("⬆️", above), ("⬇️", below)):
+                for u_id, u_xp, u_lvl in rows:
+                    neighbour = interaction.guild.get_member(u_id)
+                    neighbour_names.append(f"{label} {neighbour.display_name if neighbour else f'User {u_id}'} (Level {u_lvl})")
+            if neighbour_names:
+                rank_info.append(" · ".join(neighbour_names))
+
+        rank_info.append(
+            f"🔥 Längster Streak: **{activity_longest_streak(state.activity)} Tage** · "
+            f"Aktiv an **{activity_days_in_window(state.activity, self.current_day, 30)} von 30** Tagen"
+        )
+
+        await interaction.followup.send(content="\n".join(rank_info), file=discord.File(io.BytesIO(card_bytes), filename="rank.png"))
+
+    @discord.app_commands.command(name="xp-top", description="Zeigt, wer im gewählten Zeitraum die meisten XP gesammelt hat.")
+    @discord.app_commands.describe(zeitraum="Der Zeitraum, über den die XP zusammengezählt werden.")
+    @discord.app_commands.choices(zeitraum=[
+        discord.app_commands.Choice(name="Heute", value=1),
+        discord.app_commands.Choice(name="Letzte 7 Tage", value=7),
+        discord.app_commands.Choice(name="Letzte 30 Tage", value=30),
+    ])
+    async def xp_top_command(self, interaction: discord.Interaction, zeitraum: discord.app_commands.Choice[int]):
+        if interaction.guild_id == EXCLUDED_GUILD_ID:
+            return await interaction.response.send_message("Das Level-System ist auf diesem Server deaktiviert.", ephemeral=True)
+
+        await interaction.response.defer()
+        # Local date ordinals, the same day boundary as the daily limits and streaks.
+        first_day = date.today().toordinal() - (zeitraum.value - 1)
+        async with self.db.execute("""
+                                   SELECT user_id, SUM(xp) AS total FROM xp_daily WHERE guild_id = ? AND day >= ?
+                                   GROUP BY user_id ORDER BY total DESC LIMIT 10
+                                   """, (interaction.guild_id, first_day)) as cursor:
+            top_users = await cursor.fetchall()
+
+        leaderboard_msg = ""
+        for index, (u_id, u_xp) in enumerate(top_users):
+            member = interaction.guild.get_member(u_id)
+            name = member.display_name if member else f"User {u_id}"
+            leaderboard_msg += f"**#{index + 1}.** {name} - **{u_xp} XP**\n"
 
-        card = await self._create_rank_card(user.display_name, await user.display_avatar.read(), xp, self.xp_needed_for_level(lvl), lvl, streak)
-        await interaction.followup.send(file=discord.File(card, filename="rank.png"))
+        embed = discord.Embed(title=f"📈 XP-Ranking: {zeitraum.name}", description=leaderboard_msg or "Keine Daten.", color=discord.Color.dark_red())
+        await interaction.followup.send(embed=embed)
+
+    @discord.app_commands.command(name="levelroles-sync", description="Gleicht die Levelrollen aller Mitglieder mit ihrem Level ab.")
+    @discord.app_commands.checks.has_permissions(administrator=True)
+    async def levelroles_sync_command(self, interaction: discord.Interaction):
+        config = channels.get_config(interaction.guild_id)
+        if interaction.guild_id == EXCLUDED_GUILD_ID or not config:
+            return await interaction.response.send_message("❌ Für diesen Server sind keine Levelrollen konfiguriert.", ephemeral=True)
+
+        await interaction.response.defer(ephemeral=True)
+        snapshot = await self._get_ranking_snapshot(interaction.guild_id)
+        role_ids = {r_id for r_id in LevelRoleQueue.level_role_ids(config).values() if r_id}
+
+        total = 0
+        for member in interaction.guild.members:
+            if member.bot:
+                continue
+            level = snapshot.level_of(member.id)
+            if level >= 10 or any(role.id in role_ids for role in member.roles):
+                self.level_role_queue.enqueue(interaction.guild_id, member.id, level)
+                total += 1
+
+        await interaction.followup.send(f"⌛ Abgleich von {total} Mitgliedern gestartet, der Fortschritt wird hier im Kanal angezeigt.", ephemeral=True)
+        # A channel message, unlike the followup, stays editable past the 15-minute interaction token lifetime.
+        message = await interaction.channel.send(f"⌛ Levelrollen werden abgeglichen... 0/{total}")
+        while (remaining := self.level_role_queue.remaining(interaction.guild_id)) > 0:
+            worker = self.level_role_queue.workers.get(interaction.guild_id)
+            if worker is None or worker.done():
+                # The worker died on an unexpected error; the remaining members would never be processed.
+                return await message.edit(content=f"❌ Abgleich abgebrochen, {total - remaining}/{total} Mitglieder abgeglichen.")
+            await asyncio.sleep(5)
+            await message.edit(content=f"⌛ Levelrollen werden abgeglichen... {total - remaining}/{total}")
+        await message.edit(content=f"✅ Levelrollen von {total} Mitgliedern abgeglichen.")
+
+    @commands.command(name="rankcard-stats", hidden=True)
+    @commands.is_owner()
+    async def rankcard_stats(self, ctx: commands.Context):
+        cache = self.rank_card_cache
+        renderer = self.rank_card_renderer
+        await ctx.send(
+            f"Rangkarten-Cache: {cache.memory_hits} RAM-Treffer, {cache.disk_hits} Disk-Treffer, {cache.misses} Fehlschläge "
+            f"({cache.hit_rate:.1%} Trefferquote, {len(cache.entries)}/{cache.max_entries} Einträge)\n"
+            f"Renderer: {renderer.queue_depth} in Warteschlange (Spitze {renderer.peak_queue_depth})"
+        )
 
     async def cog_unload(self):
-        self.voice_xp_task.cancel()
+        # Bot.close() unloads every cog, so this also covers shutdown.
+        self.bot.message_router.unregister("leveling")
+        # Waiting for the lock lets a flush that is already running finish instead of cancelling it halfway;
+        # voice_xp_task ends with a flush too.
+        async with self.xp_flush_lock:
+            self.voice_xp_task.cancel()
+            self.flush_xp_task.cancel()
+        self.daily_rollover_task.cancel()
+        self.compact_xp_ledger_task.cancel()
+        self.level_role_queue.close()
+        self.announcements.close()
+        now = time.monotonic()
+        for guild_id, user_id in list(self.voice_sessions):
+            await self._credit_voice_session(guild_id, user_id, now, end_session=True)
+        await self.flush_xp_buffer()
+        self.rank_card_renderer.close()
 
 async def setup(bot):
     await bot.add_cog(Leveling(bot))
\ No newline at end of file
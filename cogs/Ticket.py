@@ -1,47 +1,600 @@
 from pathlib import Path
 import discord
 import discord.app_commands
-from discord.ext import commands
+from discord.ext import commands, tasks
 import aiosqlite
 import asyncio
-import io
+import heapq
+import aiohttp
+import gzip
+import hashlib
+import math
+import os
+import tempfile
+import zlib
+from collections import Counter
+from datetime import datetime, timezone
 from channels import get_config
 
 # --- HILFSFUNKTIONEN (angepasst auf übergebene DB) ---
 
-async def get_ticket_data(db: aiosqlite.Connection, channel_id: int):
-    async with db.execute("SELECT user_id, status, claimed_by FROM tickets WHERE channel_id = ?", (channel_id,)) as cursor:
-        return await cursor.fetchone()
-
-async def create_transcript(channel: discord.TextChannel):
-    transcript_text = f"Transkript für Ticket: {channel.name}\n"
-    transcript_text += f"ID: {channel.id}\n"
-    transcript_text = "-" * 30 + "\n\n"
-
-    async for message in channel.history(limit=None, oldest_first=True):
-        timestamp = message.created_at.strftime('%Y-%m-%d %H:%M:%S')
-        content = message.content
-
-        if message.embeds:
-            for embed in message.embeds:
-                embed_info = f"[Embed: {embed.title if embed.title else ''} - {embed.description if embed.description else ''}]"
-                content += f"\n{embed_info}"
+TICKETS_SCHEMA_VERSION = 3
+
+SLA_BUCKET_BASE = 1.25
+# Lifecycle events whose duration since ticket creation feeds a histogram.
+SLA_DURATION_METRICS = {'claim': 'time_to_claim', 'close': 'time_to_close'}
+
+def sla_bucket(seconds: float) -> int:
+    # Bucket b > 0 covers [BASE**(b-1), BASE**b) seconds, so percentiles are exact to within one bucket (~25%).
+    if seconds < 1:
+        return 0
+    return int(math.log(seconds, SLA_BUCKET_BASE)) + 1
+
+def sla_bucket_value(bucket: int) -> float:
+    if bucket == 0:
+        return 0.0
+    return SLA_BUCKET_BASE ** (bucket - 0.5)
+
+def histogram_percentile(buckets, q: float):
+    total = sum(count for _, count in buckets)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for bucket, count in buckets:
+        seen += count
+        if seen >= rank:
+            return sla_bucket_value(bucket)
+    return sla_bucket_value(buckets[-1][0])
+
+def format_duration(seconds: float) -> str:
+    if seconds is None:
+        return "–"
+    minutes = int(seconds // 60)
+    if minutes < 1:
+        return f"{int(seconds)} Sek."
+    hours, minutes = divmod(minutes, 60)
+    if hours < 1:
+        return f"{minutes} Min."
+    days, hours = divmod(hours, 24)
+    if days < 1:
+        return f"{hours} Std. {minutes} Min."
+    return f"{days} T. {hours} Std."
+
+class TicketMetrics:
+    """Buffers ticket lifecycle events and folds them into rollups when flushing.
+
+    Every flush inserts the raw events and adds them to per-guild (member_id 0) and per-member counters and
+    log-bucketed duration histograms, so /ticket-stats reads a few dozen rollup rows instead of the event log.
+    """
+
+    def __init__(self, db: aiosqlite.Connection, lock: asyncio.Lock = None):
+        self.db = db
+        self.pending = []
+        # Shared with every other writer on the connection, see TicketCog.db_lock.
+        self.lock = lock or asyncio.Lock()
+
+    def record(self, kind: str, ticket, actor_id: int = None, now: float = None):
+        if ticket.guild_id is None:
+            return
+        now = now or discord.utils.utcnow().timestamp()
+        duration = None
+        if kind in SLA_DURATION_METRICS and ticket.created_at is not None:
+            duration = max(now - ticket.created_at, 0.0)
+        self.pending.append((ticket.guild_id, ticket.channel_id, kind, actor_id, now, duration))
+
+    async def flush(self):
+        async with self.lock:
+            if not self.pending:
+                return
+
+            rows, self.pending = self.pending, []
+            counts = Counter()
+            durations = Counter()
+            for guild_id, _, kind, actor_id, _, duration in rows:
+                for member_id in ((0, actor_id) if actor_id else (0,)):
+                    counts[(guild_id, member_id, kind)] += 1
+                    if duration is not None:
+                        durations[(guild_id, member_id, SLA_DURATION_METRICS[kind], sla_bucket(duration))] += 1
+
+            try:
+                await self.db.executemany(
+                    "INSERT INTO ticket_events (guild_id, channel_id, kind, actor_id, created_at, duration) VALUES (?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+                await self.db.executemany(
+                    """
+                    INSERT INTO ticket_stats_counts (guild_id, member_id, kind, count) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(guild_id, member_id, kind) DO UPDATE SET count = count + excluded.count
+                    """,
+                    [(*key, count) for key, count in counts.items()]
+                )
+                await self.db.executemany(
+                    """
+                    INSERT INTO ticket_stats_durations (guild_id, member_id, metric, bucket, count) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(guild_id, member_id, metric, bucket) DO UPDATE SET count = count + excluded.count
+                    """,
+                    [(*key, count) for key, count in durations.items()]
+                )
+                await self.db.commit()
+            except Exception as e:
+                await self.db.rollback()
+                self.pending[:0] = rows
+                print(f"Fehler beim Speichern der Ticket-Statistiken: {e}")
+
+    async def counts(self, guild_id: int, member_id: int = 0):
+        async with self.db.execute(
+            "SELECT kind, count FROM ticket_stats_counts WHERE guild_id = ? AND member_id = ?", (guild_id, member_id)
+        ) as cursor:
+            return dict(await cursor.fetchall())
+
+    async def percentiles(self, guild_id: int, member_id: int, metric: str, quantiles=(0.5, 0.9)):
+        async with self.db.execute(
+            "SELECT bucket, count FROM ticket_stats_durations WHERE guild_id = ? AND member_id = ? AND metric = ? ORDER BY bucket",
+            (guild_id, member_id, metric)
+        ) as cursor:
+            buckets = await cursor.fetchall()
+        return [histogram_percentile(buckets, q) for q in quantiles]
+
+    async def top_members(self, guild_id: int, kind: str, limit: int = 5):
+        async with self.db.execute(
+            "SELECT member_id, count FROM ticket_stats_counts WHERE guild_id = ? AND kind = ? AND member_id != 0 ORDER BY count DESC LIMIT ?",
+            (guild_id, kind, limit)
+        ) as cursor:
+            return await cursor.fetchall()
+
+class TicketState:
+    def __init__(self, channel_id, guild_id, user_id, status, claimed_by, created_at, claimed_at, captured_since=None,
+                 last_activity=None, inactivity_warned_at=None, transcript_posted_at=None):
+        self.channel_id = channel_id
+        self.guild_id = guild_id
+        self.user_id = user_id
+        self.status = status
+        self.claimed_by = claimed_by
+        # Unix timestamps.
+        self.created_at = created_at
+        self.claimed_at = claimed_at
+        # Set when the message log has covered the channel from the start; older tickets fall back to the history.
+        self.captured_since = captured_since
+        # A delete job is scheduled; further confirm clicks must not schedule another one.
+        self.delete_scheduled = False
+        # Set once the delete job has posted the transcript, so a retried job does not post it again.
+        self.transcript_posted_at = transcript_posted_at
+        # Last message by a non-bot member and when the inactivity warning went out.
+        self.last_activity = last_activity or created_at or 0.0
+        self.inactivity_warned_at = inactivity_warned_at
+
+class TicketRegistry:
+    """In-memory copy of the tickets table, loaded once and written through on every change.
+
+    View callbacks resolve a ticket by channel and look up a member's open ticket per guild with a dict
+    lookup instead of a query. Member activity changes with every message and is written in batches by flush_activity.
+    """
+
+    def __init__(self, db: aiosqlite.Connection, metrics: TicketMetrics = None, lock: asyncio.Lock = None):
+        self.db = db
+        self.metrics = metrics
+        self.lock = lock or asyncio.Lock()
+        self.tickets = {}
+        self.open_by_member = {}
+        # Channels whose last_activity changed since the last flush_activity.
+        self.activity_dirty = set()
+
+    async def load(self):
+        self.tickets.clear()
+        self.open_by_member.clear()
+        async with self.db.execute(
+            """
+            SELECT channel_id, guild_id, user_id, status, claimed_by, created_at, claimed_at, captured_since,
+                   last_activity, inactivity_warned_at, transcript_posted_at
+            FROM tickets
+            """
+        ) as cursor:
+            for row in await cursor.fetchall():
+                self._index(TicketState(*row))
+
+    def _index(self, ticket: TicketState):
+        self.tickets[ticket.channel_id] = ticket
+        if ticket.status == 'offen':
+            self.open_by_member[(ticket.guild_id, ticket.user_id)] = ticket.channel_id
+
+    def _unindex(self, ticket: TicketState):
+        if self.open_by_member.get((ticket.guild_id, ticket.user_id)) == ticket.channel_id:
+            del self.open_by_member[(ticket.guild_id, ticket.user_id)]
+
+    def get(self, channel_id: int):
+        return self.tickets.get(channel_id)
+
+    def open_ticket_of(self, guild_id: int, user_id: int):
+        return self.open_by_member.get((guild_id, user_id))
+
+    async def _write(self, sql: str, params, many: bool = False):
+        async with self.lock:
+            if many:
+                await self.db.executemany(sql, params)
+            else:
+                await self.db.execute(sql, params)
+            await self.db.commit()
+
+    def _record(self, kind: str, ticket: TicketState, actor_id: int = None):
+        if self.metrics:
+            self.metrics.record(kind, ticket, actor_id)
+
+    async def create(self, channel_id: int, guild_id: int, user_id: int):
+        now = discord.utils.utcnow().timestamp()
+        ticket = TicketState(channel_id, guild_id, user_id, 'offen', None, now, None, now)
+        await self._write(
+            "INSERT INTO tickets (channel_id, guild_id, user_id, status, created_at, captured_since) VALUES (?, ?, ?, ?, ?, ?)",
+            (channel_id, guild_id, user_id, 'offen', ticket.created_at, ticket.captured_since)
+        )
+        self._index(ticket)
+        self._record('create', ticket, user_id)
+        return ticket
+
+    async def set_status(self, ticket: TicketState, status: str, actor_id: int = None):
+        # Closing drops the claim, like it always did.
+        claimed_by = ticket.claimed_by if status == 'offen' else None
+        claimed_at = ticket.claimed_at if status == 'offen' else None
+        # A reopened ticket starts a fresh inactivity period.
+        last_activity = discord.utils.utcnow().timestamp() if status == 'offen' else ticket.last_activity
+        warned_at = None if status == 'offen' else ticket.inactivity_warned_at
+        await self._write(
+            "UPDATE tickets SET status = ?, claimed_by = ?, claimed_at = ?, last_activity = ?, inactivity_warned_at = ? WHERE channel_id = ?",
+            (status, claimed_by, claimed_at, last_activity, warned_at, ticket.channel_id)
+        )
+        self._unindex(ticket)
+        ticket.status, ticket.claimed_by, ticket.claimed_at = status, claimed_by, claimed_at
+        ticket.last_activity, ticket.inactivity_warned_at = last_activity, warned_at
+        self._index(ticket)
+        self._record('reopen' if status == 'offen' else 'close', ticket, actor_id)
+
+    async def set_claim(self, ticket: TicketState, claimed_by: int = None, actor_id: int = None):
+        claimed_at = discord.utils.utcnow().timestamp() if claimed_by else None
+        await self._write(
+            "UPDATE tickets SET claimed_by = ?, claimed_at = ? WHERE channel_id = ?",
+            (claimed_by, claimed_at, ticket.channel_id)
+        )
+        ticket.claimed_by, ticket.claimed_at = claimed_by, claimed_at
+        self._record('claim' if claimed_by else 'unclaim', ticket, actor_id)
+
+    def touch(self, ticket: TicketState, at: float):
+        ticket.last_activity = at
+        ticket.inactivity_warned_at = None
+        self.activity_dirty.add(ticket.channel_id)
+
+    async def set_warned(self, ticket: TicketState, at: float):
+        await self._write("UPDATE tickets SET inactivity_warned_at = ? WHERE channel_id = ?", (at, ticket.channel_id))
+        ticket.inactivity_warned_at = at
+
+    async def set_transcript_posted(self, ticket: TicketState, at: float):
+        await self._write("UPDATE tickets SET transcript_posted_at = ? WHERE channel_id = ?", (at, ticket.channel_id))
+        ticket.transcript_posted_at = at
+
+    async def flush_activity(self):
+        if not self.activity_dirty:
+            return
+
+        channel_ids, self.activity_dirty = self.activity_dirty, set()
+        rows = [
+            (ticket.last_activity, ticket.inactivity_warned_at, ticket.channel_id)
+            for ticket in map(self.tickets.get, channel_ids) if ticket
+        ]
+        try:
+            await self._write("UPDATE tickets SET last_activity = ?, inactivity_warned_at = ? WHERE channel_id = ?", rows, many=True)
+        except Exception as e:
+            self.activity_dirty |= channel_ids
+            print(f"Fehler beim Speichern der Ticket-Aktivität: {e}")
+
+    async def remove(self, ticket: TicketState, actor_id: int = None):
+        await self._write("DELETE FROM tickets WHERE channel_id = ?", (ticket.channel_id,))
+        self._unindex(ticket)
+        self.tickets.pop(ticket.channel_id, None)
+        self._record('delete', ticket, actor_id)
+
+    async def backfill_guild_ids(self, bot: commands.Bot):
+        # Rows from before the guild_id column can only be attributed once the channel cache is filled.
+        # Returns the tickets that got a guild, so the caller can start watching them.
+        updated = []
+        updates = []
+        for ticket in list(self.tickets.values()):
+            if ticket.guild_id is not None:
+                continue
+            channel = bot.get_channel(ticket.channel_id)
+            if channel:
+                self._unindex(ticket)
+                ticket.guild_id = channel.guild.id
+                self._index(ticket)
+                updated.append(ticket)
+                updates.append((ticket.guild_id, ticket.channel_id))
+
+        if updates:
+            await self._write("UPDATE tickets SET guild_id = ? WHERE channel_id = ?", updates, many=True)
+            print(f"✅ {len(updates)} Tickets einem Server zugeordnet.")
+        return updated
+
+async def save_ticket_messages(db: aiosqlite.Connection, rows):
+    await db.executemany(
+        "INSERT INTO ticket_messages (channel_id, message_id, kind, author_id, author_name, created_at, content) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        rows
+    )
+
+async def delete_ticket_messages(db: aiosqlite.Connection, channel_id: int):
+    await db.execute("DELETE FROM ticket_messages WHERE channel_id = ?", (channel_id,))
+
+async def save_ticket_attachments(db: aiosqlite.Connection, rows):
+    await db.executemany(
+        "INSERT INTO ticket_attachments (channel_id, message_id, filename, sha256) VALUES (?, ?, ?, ?)",
+        rows
+    )
+
+async def delete_ticket_attachments(db: aiosqlite.Connection, channel_id: int):
+    # Only the references go; the blobs may be shared with other tickets and are left to AttachmentArchive eviction.
+    await db.execute("DELETE FROM ticket_attachments WHERE channel_id = ?", (channel_id,))
+
+def describe_message(message: discord.Message):
+    content = message.content
+    if message.embeds:
+        for embed in message.embeds:
+            embed_info = f"[Embed: {embed.title if embed.title else ''} - {embed.description if embed.description else ''}]"
+            content += f"\n{embed_info}"
+    return content
+
+ATTACHMENT_ARCHIVE_PATH = Path("data/ticket_attachments")
+ATTACHMENT_ARCHIVE_MAX_BYTES = 5 * 1024 ** 3
+ATTACHMENT_DOWNLOAD_CONCURRENCY = 4
+
+def archived_path(sha256: str) -> str:
+    return f"{sha256[:2]}/{sha256}"
+
+class AttachmentArchive:
+    """Content-addressed store for ticket attachments, so they outlive the Discord CDN links of deleted channels.
+
+    Blobs live under `root/<sha256[:2]>/<sha256>`, so the same file posted in several tickets is stored once.
+    Downloads are streamed to disk while hashing and at most `concurrency` run at the same time. When the store
+    grows beyond `max_bytes`, the least recently stored or re-referenced blobs are evicted first.
+    """
+
+    def __init__(self, db: aiosqlite.Connection, root: Path = ATTACHMENT_ARCHIVE_PATH,
+                 max_bytes: int = ATTACHMENT_ARCHIVE_MAX_BYTES, concurrency: int = ATTACHMENT_DOWNLOAD_CONCURRENCY,
+                 lock: asyncio.Lock = None):
+        self.db = db
+        self.root = root
+        self.max_bytes = max_bytes
+        self.semaphore = asyncio.Semaphore(concurrency)
+        # Serialises moving blobs into place, the blob index and eviction; shared with the other writers on db.
+        self.lock = lock or asyncio.Lock()
+        self.session = None
+        self.total_bytes = 0
+
+    async def open(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        async with self.db.execute("SELECT COALESCE(SUM(size), 0) FROM attachment_blobs") as cursor:
+            self.total_bytes = (await cursor.fetchone())[0]
+        self.session = aiohttp.ClientSession()
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    def path_for(self, sha256: str) -> Path:
+        return self.root / archived_path(sha256)
+
+    async def _download(self, attachment: discord.Attachment):
+        part_path = self.root / f".{attachment.id}.part"
+        hasher = hashlib.sha256()
+        size = 0
+        try:
+            async with self.session.get(attachment.url) as response:
+                response.raise_for_status()
+                with part_path.open("wb") as f:
+                    async for chunk in response.content.iter_chunked(64 * 1024):
+                        hasher.update(chunk)
+                        f.write(chunk)
+                        size += len(chunk)
+        except Exception:
+            part_path.unlink(missing_ok=True)
+            raise
+        return part_path, hasher.hexdigest(), size
+
+    async def store(self, attachment: discord.Attachment):
+        if not self.session:
+            return None
+
+        async with self.semaphore:
+            try:
+                part_path, sha256, size = await self._download(attachment)
+            except Exception as e:
+                print(f"Fehler beim Archivieren des Anhangs {attachment.filename}: {e}")
+                return None
+
+        async with self.lock:
+            target = self.path_for(sha256)
+            if target.exists():
+                part_path.unlink(missing_ok=True)
+            else:
+                target.parent.mkdir(exist_ok=True)
+                os.replace(part_path, target)
+
+            now = discord.utils.utcnow().timestamp()
+            async with self.db.execute("SELECT 1 FROM attachment_blobs WHERE sha256 = ?", (sha256,)) as cursor:
+                known = await cursor.fetchone() is not None
+            if known:
+                await self.db.execute("UPDATE attachment_blobs SET last_access = ? WHERE sha256 = ?", (now, sha256))
+            else:
+                await self.db.execute("INSERT INTO attachment_blobs (sha256, size, last_access) VALUES (?, ?, ?)", (sha256, size, now))
+                self.total_bytes += size
+
+            await self._evict()
+            await self.db.commit()
+        return sha256
+
+    async def store_all(self, attachments):
+        return await asyncio.gather(*(self.store(attachment) for attachment in attachments))
+
+    async def _evict(self):
+        while self.total_bytes > self.max_bytes:
+            async with self.db.execute("SELECT sha256, size FROM attachment_blobs ORDER BY last_access LIMIT 100") as cursor:
+                rows = await cursor.fetchall()
+            if not rows:
+                break
+
+            evicted = []
+            for sha256, size in rows:
+                self.path_for(sha256).unlink(missing_ok=True)
+                evicted.append((sha256,))
+                self.total_bytes -= size
+                if self.total_bytes <= self.max_bytes:
+                    break
+            await self.db.executemany("DELETE FROM attachment_blobs WHERE sha256 = ?", evicted)
+
+TRANSCRIPT_SPOOL_SIZE = 1024 * 1024
+TRANSCRIPT_COMPRESS = True
+
+class TranscriptWriter:
+    """Streams transcript lines into spooled temp files and starts a new part before one would exceed `part_limit`.
+
+    Each part is a complete file of its own (a separate gzip stream when compressing), and lines are never split
+    across parts. Only up to TRANSCRIPT_SPOOL_SIZE bytes per part are kept in memory; the rest spills to disk.
+    """
+
+    def __init__(self, base_name: str, part_limit: int, compress: bool = TRANSCRIPT_COMPRESS):
+        self.base_name = base_name
+        self.part_limit = part_limit
+        self.compress = compress
+        self.parts = []
+        self._raw = None
+        self._stream = None
+        # Upper bound for bytes the compressor has accepted but not yet written to the raw file.
+        self._unflushed = 0
+
+    def _open_part(self):
+        self._raw = tempfile.SpooledTemporaryFile(max_size=TRANSCRIPT_SPOOL_SIZE)
+        self._stream = gzip.GzipFile(fileobj=self._raw, mode="wb") if self.compress else self._raw
+        self._unflushed = 0
+        self.parts.append(self._raw)
+
+    def _finish_part(self):
+        if self._stream is not self._raw:
+            self._stream.close()
+        self._raw.seek(0)
+
+    def write_line(self, line: str):
+        data = (line + "\n").encode("utf-8")
+        if self._raw is None:
+            self._open_part()
+
+        # Deflate output never exceeds its input by more than a few bytes per block, so raw size plus
+        # everything unflushed is a safe bound. Only near the limit do we pay for a sync flush to learn the real size.
+        if self._raw.tell() + self._unflushed + len(data) + 64 > self.part_limit and self._raw.tell() > 0:
+            if self._stream is not self._raw and self._unflushed:
+                self._stream.flush(zlib.Z_SYNC_FLUSH)
+                self._unflushed = 0
+            if self._raw.tell() + len(data) + 64 > self.part_limit:
+                self._finish_part()
+                self._open_part()
+
+        self._stream.write(data)
+        if self._stream is not self._raw:
+            self._unflushed += len(data)
+
+    def files(self):
+        if self._raw is None:
+            self._open_part()
+        self._finish_part()
+
+        extension = ".txt.gz" if self.compress else ".txt"
+        if len(self.parts) == 1:
+            return [discord.File(self.parts[0], filename=f"{self.base_name}{extension}")]
+        return [
+            discord.File(part, filename=f"{self.base_name}-teil{index}{extension}")
+            for index, part in enumerate(self.parts, start=1)
+        ]
+
+    def discard(self):
+        for part in self.parts:
+            part.close()
+        self.parts.clear()
+
+def format_transcript_line(kind: str, message_id: int, author_name: str, created_at: float, content: str, attachments=()):
+    timestamp = datetime.fromtimestamp(created_at, tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    if kind == 'edit':
+        line = f"[{timestamp}] {author_name} (bearbeitet, Nachricht {message_id}): {content}"
+    elif kind == 'delete':
+        return f"[{timestamp}] Nachricht {message_id} wurde gelöscht"
+    else:
+        line = f"[{timestamp}] {author_name}: {content}"
+
+    for filename, archived_path in attachments:
+        line += f"\n[Anhang: {filename} -> {archived_path or 'nicht archiviert'}]"
+    return line
+
+async def create_transcript(channel: discord.TextChannel, db: aiosqlite.Connection = None, archive: AttachmentArchive = None):
+    # Pass db only if the message log covers the whole ticket (TicketState.captured_since); otherwise the history is read.
+    writer = TranscriptWriter(f"transcript-{channel.name}", channel.guild.filesize_limit)
+    try:
+        writer.write_line(f"Transkript für Ticket: {channel.name}")
+        writer.write_line(f"ID: {channel.id}")
+        writer.write_line(f"Anhänge archiviert unter: {ATTACHMENT_ARCHIVE_PATH}")
+        writer.write_line("-" * 30 + "\n")
+
+        if db:
+            async with db.execute(
+                """
+                SELECT m.kind, m.message_id, m.author_name, m.created_at, m.content,
+                       (SELECT group_concat(a.filename || char(9) || a.sha256, char(10))
+                        FROM ticket_attachments a WHERE a.message_id = m.message_id)
+                FROM ticket_messages m
+                WHERE m.channel_id = ?
+                ORDER BY m.id
+                """,
+                (channel.id,)
+            ) as cursor:
+                async for *row, attachment_list in cursor:
+                    attachments = []
+                    if attachment_list and row[0] == 'message':
+                        for entry in attachment_list.split("\n"):
+                            filename, sha256 = entry.split("\t")
+                            attachments.append((filename, archived_path(sha256)))
+                    writer.write_line(format_transcript_line(*row, attachments))
+        else:
+            # Tickets opened before live capture existed have no or only partial log rows.
+            async for message in channel.history(limit=None, oldest_first=True):
+                attachments = []
+                if message.attachments and archive:
+                    hashes = await archive.store_all(message.attachments)
+                    attachments = [
+                        (attachment.filename, archived_path(sha256) if sha256 else None)
+                        for attachment, sha256 in zip(message.attachments, hashes)
+                    ]
+                writer.write_line(format_transcript_line('message', message.id, str(message.author), message.created_at.timestamp(), describe_message(message), attachments))
+
+        return writer.files()
+    except Exception:
+        writer.discard()
+        raise
+
+async def log_to_channel(bot, guild, embed, file=None, files=None):
+    files = list(files or [])
+    if file:
+        files.insert(0, file)
 
-        transcript_text += f"[{timestamp}] {message.author}: {content}\n"
+    config = get_config(guild.id)
+    log_channel = bot.get_channel(config.log_channel_id) if config else None
+    if not log_channel:
+        for f in files:
+            f.close()
+        return
 
-    return io.BytesIO(transcript_text.encode('utf-8'))
+    # Each part is already as large as a single upload may be, so every further part gets its own message.
+    await log_channel.send(embed=embed, files=files[:1])
+    for f in files[1:]:
+        await log_channel.send(file=f)
 
-async def log_to_channel(bot, guild, embed, file=None):
+def ticket_category(guild: discord.Guild, status: str, claimed_by_id: int = None):
     config = get_config(guild.id)
-    if config:
-        log_channel = bot.get_channel(config.log_channel_id)
-        if log_channel:
-            await log_channel.send(embed=embed, file=file)
-
-async def move_ticket_category(channel: discord.TextChannel, status: str, claimed_by_id: int = None):
-    config = get_config(channel.guild.id)
     if not config:
-        return
+        return None
 
     category_id = None
     if status == 'geschlossen':
@@ -52,41 +605,77 @@ async def move_ticket_category(channel: discord.TextChannel, status: str, claime
         else:
             category_id = config.OPEN_CATEGORY_ID
 
-    if category_id:
-        category = channel.guild.get_channel(category_id)
-        if category and isinstance(category, discord.CategoryChannel):
-            await channel.edit(category=category)
+    category = guild.get_channel(category_id) if category_id else None
+    return category if isinstance(category, discord.CategoryChannel) else None
+
+async def move_ticket_category(channel: discord.TextChannel, status: str, claimed_by_id: int = None):
+    category = ticket_category(channel.guild, status, claimed_by_id)
+    if category and channel.category_id != category.id:
+        await channel.edit(category=category)
+
+async def apply_ticket_state(channel: discord.TextChannel, overwrites_to_update: dict, status: str, claimed_by_id: int = None):
+    # One PATCH for all permission changes and the category move instead of one request per overwrite target.
+    overwrites = dict(channel.overwrites)
+    overwrites.update(overwrites_to_update)
+
+    changes = {"overwrites": overwrites}
+    category = ticket_category(channel.guild, status, claimed_by_id)
+    if category and channel.category_id != category.id:
+        changes["category"] = category
+    await channel.edit(**changes)
+
+async def close_ticket(registry: TicketRegistry, channel: discord.TextChannel, ticket: TicketState, config, actor_id: int = None):
+    overwrites_to_update = {}
+    for target, permissions in channel.overwrites.items():
+        is_team_or_bot = isinstance(target, discord.Role) and target.id == config.team_role_id or target.id == channel.guild.me.id
+        if not is_team_or_bot and permissions.send_messages:
+            overwrites_to_update[target] = discord.PermissionOverwrite(
+                send_messages=False,
+                read_messages=True,
+                read_message_history=True
+            )
+
+    member = channel.guild.get_member(ticket.user_id)
+    if member and member not in overwrites_to_update:
+        overwrites_to_update[member] = discord.PermissionOverwrite(
+            send_messages=False,
+            read_messages=True,
+            read_message_history=True
+        )
+
+    await apply_ticket_state(channel, overwrites_to_update, 'geschlossen')
+    await registry.set_status(ticket, 'geschlossen', actor_id)
 
 # --- VIEWS ---
 
+TICKET_DELETE_JOB = "ticket_delete"
+TICKET_DELETE_DELAY = 5
+TICKET_INACTIVITY_WARNING_HOURS = 12
+
 class ConfirmDeleteView(discord.ui.View):
-    def __init__(self, db: aiosqlite.Connection):
+    def __init__(self, registry: TicketRegistry):
         super().__init__(timeout=None)
-        self.db = db
+        self.registry = registry
 
     @discord.ui.button(label="✅ Ja, löschen", style=discord.ButtonStyle.red, custom_id="confirm_delete_button")
     async def confirm_delete_callback(self, interaction: discord.Interaction, button: discord.ui.Button):
-        ticket_data = await get_ticket_data(self.db, interaction.channel_id)
-        if not ticket_data:
+        ticket = self.registry.get(interaction.channel_id)
+        if not ticket:
             return await interaction.response.send_message("❌ Dieses Ticket existiert nicht mehr in der Datenbank.", ephemeral=True)
 
-        await interaction.response.send_message("Ticket wird in 5 Sekunden gelöscht...", ephemeral=True)
-        channel = interaction.channel
-        transcript_file = await create_transcript(channel)
-        file = discord.File(transcript_file, filename=f"transcript-{channel.name}.txt")
-
-        log_embed = discord.Embed(
-            title="Ticket Gelöscht",
-            description=f"Ticket **{channel.name}** wurde von {interaction.user.mention} gelöscht.",
-            color=discord.Color.dark_red()
-        )
-
-        await asyncio.sleep(5)
-        await self.db.execute("DELETE FROM tickets WHERE channel_id = ?", (channel.id,))
-        await self.db.commit()
+        if ticket.delete_scheduled:
+            return await interaction.response.send_message("⚠️ Dieses Ticket wird bereits gelöscht.", ephemeral=True)
 
-        await log_to_channel(interaction.client, interaction.guild, log_embed, file=file)
-        await channel.delete()
+        # Persisted, so a restart within the delay does not lose the deletion.
+        ticket.delete_scheduled = True
+        try:
+            await interaction.client.scheduler.schedule(
+                TICKET_DELETE_JOB, TICKET_DELETE_DELAY, {"channel_id": ticket.channel_id, "actor_id": interaction.user.id}
+            )
+        except Exception:
+            ticket.delete_scheduled = False
+            raise
+        await interaction.response.send_message(f"Ticket wird in {TICKET_DELETE_DELAY} Sekunden gelöscht...", ephemeral=True)
 
     @discord.ui.button(label="❌ Abbrechen", style=discord.ButtonStyle.green, custom_id="cancel_delete_button")
     async def cancel_delete_callback(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -94,9 +683,9 @@ class ConfirmDeleteView(discord.ui.View):
         await interaction.response.edit_message(embed=embed, view=None)
 
 class ClosedTicketView(discord.ui.View):
-    def __init__(self, db: aiosqlite.Connection):
+    def __init__(self, registry: TicketRegistry):
         super().__init__(timeout=None)
-        self.db = db
+        self.registry = registry
 
     @discord.ui.button(label="🔓 Wieder öffnen", style=discord.ButtonStyle.green, custom_id="ticket_open_button")
     async def open_ticket_callback(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -104,11 +693,11 @@ class ClosedTicketView(discord.ui.View):
             return await interaction.response.send_message("⚠️ Du hast nicht die Berechtigung, dieses Ticket zu öffnen!", ephemeral=True)
 
         channel = interaction.channel
-        ticket_data = await get_ticket_data(self.db, channel.id)
+        ticket = self.registry.get(channel.id)
 
-        if not ticket_data:
+        if not ticket:
             return await interaction.response.send_message("❌ Fehler: Ticket nicht in der Datenbank gefunden.", ephemeral=True)
-        if ticket_data[1] == 'offen':
+        if ticket.status == 'offen':
             return await interaction.response.send_message("⚠️ Dieses Ticket ist bereits geöffnet.", ephemeral=True)
 
         overwrites_to_update = {}
@@ -120,13 +709,15 @@ class ClosedTicketView(discord.ui.View):
                     read_message_history=True
                 )
 
-        for target, overwrite in overwrites_to_update.items():
-            await channel.set_permissions(target, overwrite=overwrite)
+        await apply_ticket_state(channel, overwrites_to_update, 'offen')
 
-        await self.db.execute("UPDATE tickets SET status = ? WHERE channel_id = ?", ('offen', channel.id))
-        await self.db.commit()
+        await self.registry.set_status(ticket, 'offen', interaction.user.id)
+        ticket_cog = interaction.client.get_cog("TicketCog")
+        if ticket_cog:
+            ticket_cog.watch_inactivity(ticket)
 
-        await move_ticket_category(channel, 'offen')
+        embed = discord.Embed(title="🔓 Ticket wieder geöffnet", description=f"{interaction.user.mention} hat das Ticket geöffnet!", color=discord.Color.dark_red())
+        await interaction.response.send_message(embed=embed, view=OpenTicketView(self.registry))
 
         log_embed = discord.Embed(
             title="Ticket Wiedereröffnet",
@@ -135,9 +726,6 @@ class ClosedTicketView(discord.ui.View):
         )
         await log_to_channel(interaction.client, interaction.guild, log_embed)
 
-        embed = discord.Embed(title="🔓 Ticket wieder geöffnet", description=f"{interaction.user.mention} hat das Ticket geöffnet!", color=discord.Color.dark_red())
-        await interaction.response.send_message(embed=embed, view=OpenTicketView(self.db))
-
     @discord.ui.button(label="⛔ Löschen", style=discord.ButtonStyle.red, custom_id="delete_ticket_button")
     async def delete_ticket_callback(self, interaction: discord.Interaction, button: discord.ui.Button):
         if not interaction.user.guild_permissions.manage_messages:
@@ -148,12 +736,12 @@ class ClosedTicketView(discord.ui.View):
             description="Diese Aktion kann **nicht** rückgängig gemacht werden. Der Channel wird permanent gelöscht.",
             color=discord.Color.dark_red()
         )
-        await interaction.response.send_message(embed=embed, view=ConfirmDeleteView(self.db), ephemeral=True)
+        await interaction.response.send_message(embed=embed, view=ConfirmDeleteView(self.registry), ephemeral=True)
 
 class OpenTicketView(discord.ui.View):
-    def __init__(self, db: aiosqlite.Connection):
+    def __init__(self, registry: TicketRegistry):
         super().__init__(timeout=None)
-        self.db = db
+        self.registry = registry
 
     @discord.ui.button(label="🔒 Schließen", style=discord.ButtonStyle.red, custom_id="ticket_close_button")
     async def close_ticket_callback(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -161,43 +749,25 @@ class OpenTicketView(discord.ui.View):
             return await interaction.response.send_message("⚠️ Du hast nicht die Berechtigung, dieses Ticket zu schließen.", ephemeral=True)
 
         channel = interaction.channel
-        ticket_data = await get_ticket_data(self.db, channel.id)
+        ticket = self.registry.get(channel.id)
 
-        if not ticket_data:
+        if not ticket:
             return await interaction.response.send_message("❌ Fehler: Ticket nicht in der Datenbank gefunden.", ephemeral=True)
-        if ticket_data[1] == 'geschlossen':
+        if ticket.status == 'geschlossen':
             return await interaction.response.send_message("⚠️ Dieses Ticket ist bereits geschlossen.", ephemeral=True)
 
         config = get_config(interaction.guild.id)
         if not config:
             return await interaction.response.send_message("❌ Fehler: Konfiguration für diesen Server nicht gefunden.", ephemeral=True)
 
-        overwrites_to_update = {}
-        for target, permissions in channel.overwrites.items():
-            is_team_or_bot = isinstance(target, discord.Role) and target.id == config.team_role_id or target.id == interaction.guild.me.id
-            if not is_team_or_bot and permissions.send_messages:
-                overwrites_to_update[target] = discord.PermissionOverwrite(
-                    send_messages=False,
-                    read_messages=True,
-                    read_message_history=True
-                )
-
-        user_id = ticket_data[0]
-        member = interaction.guild.get_member(user_id)
-        if member and member not in overwrites_to_update:
-            overwrites_to_update[member] = discord.PermissionOverwrite(
-                send_messages=False,
-                read_messages=True,
-                read_message_history=True
-            )
+        await close_ticket(self.registry, channel, ticket, config, interaction.user.id)
 
-        for target, overwrite in overwrites_to_update.items():
-            await channel.set_permissions(target, overwrite=overwrite)
-
-        await self.db.execute("UPDATE tickets SET status = ?, claimed_by = NULL WHERE channel_id = ?", ('geschlossen', channel.id))
-        await self.db.commit()
-
-        await move_ticket_category(channel, 'geschlossen')
+        embed = discord.Embed(
+            title="🔒 Ticket geschlossen",
+            description=f"{interaction.user.mention} hat das Ticket geschlossen.",
+            color=discord.Color.dark_red()
+        )
+        await interaction.response.send_message(embed=embed, view=ClosedTicketView(self.registry))
 
         log_embed = discord.Embed(
             title="Ticket Geschlossen",
@@ -206,36 +776,29 @@ class OpenTicketView(discord.ui.View):
         )
         await log_to_channel(interaction.client, interaction.guild, log_embed)
 
-        embed = discord.Embed(
-            title="🔒 Ticket geschlossen",
-            description=f"{interaction.user.mention} hat das Ticket geschlossen.",
-            color=discord.Color.dark_red()
-        )
-        await interaction.response.send_message(embed=embed, view=ClosedTicketView(self.db))
-
 class TicketClaimView(discord.ui.View):
-    def __init__(self, db: aiosqlite.Connection):
+    def __init__(self, registry: TicketRegistry):
         super().__init__(timeout=None)
-        self.db = db
+        self.registry = registry
 
     @discord.ui.button(label="👍 Claim", style=discord.ButtonStyle.secondary, custom_id="ticket_claim_button")
     async def claim_ticket_callback(self, interaction: discord.Interaction, button: discord.ui.Button):
         if not interaction.user.guild_permissions.manage_messages:
             return await interaction.response.send_message("⚠️ Du hast nicht die Berechtigung, dieses Ticket zu claimen.", ephemeral=True)
 
-        ticket_data = await get_ticket_data(self.db, interaction.channel.id)
-        if not ticket_data:
+        ticket = self.registry.get(interaction.channel.id)
+        if not ticket:
             return await interaction.response.send_message("❌ Fehler: Ticket nicht in der Datenbank gefunden.", ephemeral=True)
 
-        if ticket_data[1] != 'offen':
+        if ticket.status != 'offen':
             return await interaction.response.send_message("⚠️ Nur offene Tickets können geclaimt werden.", ephemeral=True)
 
-        claimed_by_id = ticket_data[2]
+        claimed_by_id = ticket.claimed_by
         new_claimed_by_id = None
 
         if claimed_by_id is None:
             new_claimed_by_id = interaction.user.id
-            await self.db.execute("UPDATE tickets SET claimed_by = ? WHERE channel_id = ?", (new_claimed_by_id, interaction.channel.id))
+            await self.registry.set_claim(ticket, new_claimed_by_id, interaction.user.id)
             embed = discord.Embed(description=f"{interaction.user.mention} hat dieses Ticket geclaimt.", color=discord.Color.dark_red())
             await move_ticket_category(interaction.channel, 'offen', claimed_by_id=new_claimed_by_id)
 
@@ -247,7 +810,7 @@ class TicketClaimView(discord.ui.View):
             await log_to_channel(interaction.client, interaction.guild, log_embed)
 
         elif claimed_by_id == interaction.user.id:
-            await self.db.execute("UPDATE tickets SET claimed_by = NULL WHERE channel_id = ?", (interaction.channel.id,))
+            await self.registry.set_claim(ticket, None, interaction.user.id)
             embed = discord.Embed(description=f"{interaction.user.mention} hat den Claim für dieses Ticket entfernt.", color=discord.Color.dark_red())
             await move_ticket_category(interaction.channel, 'offen', claimed_by_id=None)
 
@@ -262,13 +825,12 @@ class TicketClaimView(discord.ui.View):
             claimer = interaction.guild.get_member(claimed_by_id)
             return await interaction.response.send_message(f"Dieses Ticket ist bereits von {claimer.mention if claimer else 'einem Teammitglied'} geclaimt.", ephemeral=True)
 
-        await self.db.commit()
         await interaction.response.send_message(embed=embed)
 
 class TicketCreateView(discord.ui.View):
-    def __init__(self, db: aiosqlite.Connection):
+    def __init__(self, registry: TicketRegistry):
         super().__init__(timeout=None)
-        self.db = db
+        self.registry = registry
 
     @discord.ui.button(label="✉️ Ticket erstellen", style=discord.ButtonStyle.green, custom_id="ticket_create_button")
     async def create_ticket_callback(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -278,11 +840,9 @@ class TicketCreateView(discord.ui.View):
         if not config:
             return await interaction.followup.send("Fehler: Konfiguration für diesen Server nicht gefunden.", ephemeral=True)
 
-        async with self.db.execute("SELECT channel_id FROM tickets WHERE user_id = ? AND status = ?", (interaction.user.id, 'offen')) as cursor:
-            existing_ticket = await cursor.fetchone()
-
-        if existing_ticket:
-            return await interaction.followup.send(f"Du hast bereits ein offenes Ticket: <#{existing_ticket[0]}>", ephemeral=True)
+        existing_channel_id = self.registry.open_ticket_of(interaction.guild.id, interaction.user.id)
+        if existing_channel_id:
+            return await interaction.followup.send(f"Du hast bereits ein offenes Ticket: <#{existing_channel_id}>", ephemeral=True)
 
         guild = interaction.guild
         category = guild.get_channel(config.OPEN_CATEGORY_ID)
@@ -301,12 +861,11 @@ class TicketCreateView(discord.ui.View):
 
         channel_name = f"ticket-{interaction.user.name}"
         new_channel = await guild.create_text_channel(name=channel_name, overwrites=overwrites, category=category)
-
-        await self.db.execute(
-            "INSERT INTO tickets (channel_id, user_id, status) VALUES (?, ?, ?)",
-            (new_channel.id, interaction.user.id, 'offen')
-        )
-        await self.db.commit()
+        ticket = await self.registry.create(new_channel.id, guild.id, interaction.user.id)
+        ticket_cog = interaction.client.get_cog("TicketCog")
+        if ticket_cog:
+            ticket_cog.track_channel(new_channel.id)
+            ticket_cog.watch_inactivity(ticket)
 
         embed = discord.Embed(
             title=f"Willkommen, {interaction.user.display_name}!",
@@ -319,8 +878,8 @@ class TicketCreateView(discord.ui.View):
             color=discord.Color.dark_red()
         )
 
-        await new_channel.send(embed=embed, view=OpenTicketView(self.db), content=f"{interaction.user.mention}")
-        await new_channel.send(view=TicketClaimView(self.db))
+        await new_channel.send(embed=embed, view=OpenTicketView(self.registry), content=f"{interaction.user.mention}")
+        await new_channel.send(view=TicketClaimView(self.registry))
         await interaction.followup.send(f"Dein Ticket wurde erstellt: {new_channel.mention}", ephemeral=True)
         await log_to_channel(interaction.client, interaction.guild, log_embed)
 
@@ -330,28 +889,443 @@ class TicketCog(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.db = bot.tickets_db
+        self.MESSAGE_LOG_MAX_PENDING = 100
+        # tickets_db is one connection for everything below: a commit or rollback covers whatever another coroutine
+        # executed in between, so every write transaction holds this lock.
+        self.db_lock = asyncio.Lock()
+        self.metrics = TicketMetrics(self.db, self.db_lock)
+        self.registry = TicketRegistry(self.db, self.metrics, self.db_lock)
+        # (next check time, channel_id); at most one entry per ticket, see watch_inactivity.
+        self.inactivity_heap = []
+        self.inactivity_watched = set()
+        self.pending_messages = []
+        self.attachment_archive = AttachmentArchive(self.db, lock=self.db_lock)
+        # Channels whose delete job is running right now.
+        self.deleting = set()
 
     async def cog_load(self):
         await self.init_db()
-        self.bot.add_view(TicketCreateView(self.db))
-        self.bot.add_view(OpenTicketView(self.db))
-        self.bot.add_view(ClosedTicketView(self.db))
-        self.bot.add_view(ConfirmDeleteView(self.db))
-        self.bot.add_view(TicketClaimView(self.db))
+        await self.attachment_archive.open()
+        await self.registry.load()
+        self.bot.message_router.register("tickets", self.handle_message, channel_ids=self.registry.tickets.keys())
+        self.flush_message_log_task.start()
+        self.backfill_task = asyncio.create_task(self.backfill_ticket_guilds())
+        for payload in self.bot.scheduler.payloads(TICKET_DELETE_JOB):
+            ticket = self.registry.get(payload["channel_id"])
+            if ticket:
+                ticket.delete_scheduled = True
+        self.bot.scheduler.register(TICKET_DELETE_JOB, self.run_ticket_delete_job, on_give_up=self.ticket_delete_given_up)
+        for ticket in self.registry.tickets.values():
+            self.watch_inactivity(ticket)
+        self.inactivity_task.start()
+        self.bot.add_view(TicketCreateView(self.registry))
+        self.bot.add_view(OpenTicketView(self.registry))
+        self.bot.add_view(ClosedTicketView(self.registry))
+        self.bot.add_view(ConfirmDeleteView(self.registry))
+        self.bot.add_view(TicketClaimView(self.registry))
 
     async def init_db(self):
+        async with self.db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tickets'") as cursor:
+            table_exists = await cursor.fetchone() is not None
+
         await self.db.execute(
             """
             CREATE TABLE IF NOT EXISTS tickets (
                                                    channel_id INTEGER PRIMARY KEY,
+                                                   guild_id INTEGER,
                                                    user_id INTEGER NOT NULL,
                                                    status TEXT NOT NULL,
-                                                   claimed_by INTEGER
+                                                   claimed_by INTEGER,
+                                                   created_at REAL,
+                                                   claimed_at REAL,
+                                                   captured_since REAL,
+                                                   last_activity REAL,
+                                                   inactivity_warned_at REAL,
+                                                   transcript_posted_at REAL
+            )
+            """
+        )
+        if table_exists:
+            await self._migrate_db()
+        await self.db.execute("CREATE INDEX IF NOT EXISTS idx_tickets_guild_user_status ON tickets (guild_id, user_id, status)")
+        await self.db.execute(f"PRAGMA user_version = {TICKETS_SCHEMA_VERSION}")
+        await self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ticket_messages (
+                                                           id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                                           channel_id INTEGER NOT NULL,
+                                                           message_id INTEGER NOT NULL,
+                                                           kind TEXT NOT NULL,
+                                                           author_id INTEGER,
+                                                           author_name TEXT,
+                                                           created_at REAL NOT NULL,
+                                                           content TEXT
+            )
+            """
+        )
+        await self.db.execute("CREATE INDEX IF NOT EXISTS idx_ticket_messages_channel ON ticket_messages (channel_id, id)")
+        await self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ticket_attachments (
+                                                              channel_id INTEGER NOT NULL,
+                                                              message_id INTEGER NOT NULL,
+                                                              filename TEXT NOT NULL,
+                                                              sha256 TEXT NOT NULL
+            )
+            """
+        )
+        await self.db.execute("CREATE INDEX IF NOT EXISTS idx_ticket_attachments_message ON ticket_attachments (message_id)")
+        await self.db.execute("CREATE INDEX IF NOT EXISTS idx_ticket_attachments_channel ON ticket_attachments (channel_id)")
+        await self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS attachment_blobs (
+                                                            sha256 TEXT PRIMARY KEY,
+                                                            size INTEGER NOT NULL,
+                                                            last_access REAL NOT NULL
+            )
+            """
+        )
+        await self.db.execute("CREATE INDEX IF NOT EXISTS idx_attachment_blobs_access ON attachment_blobs (last_access)")
+        await self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ticket_events (
+                                                         id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                                         guild_id INTEGER NOT NULL,
+                                                         channel_id INTEGER NOT NULL,
+                                                         kind TEXT NOT NULL,
+                                                         actor_id INTEGER,
+                                                         created_at REAL NOT NULL,
+                                                         duration REAL
+            )
+            """
+        )
+        await self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ticket_stats_counts (
+                                                               guild_id INTEGER NOT NULL,
+                                                               member_id INTEGER NOT NULL,
+                                                               kind TEXT NOT NULL,
+                                                               count INTEGER NOT NULL DEFAULT 0,
+                                                               PRIMARY KEY (guild_id, member_id, kind)
+            )
+            """
+        )
+        await self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ticket_stats_durations (
+                                                                  guild_id INTEGER NOT NULL,
+                                                                  member_id INTEGER NOT NULL,
+                                                                  metric TEXT NOT NULL,
+                                                                  bucket INTEGER NOT NULL,
+                                                                  count INTEGER NOT NULL DEFAULT 0,
+                                                                  PRIMARY KEY (guild_id, member_id, metric, bucket)
             )
             """
         )
         await self.db.commit()
 
+    async def _migrate_db(self):
+        async with self.db.execute("PRAGMA user_version") as cursor:
+            version = (await cursor.fetchone())[0]
+
+        if version < 1:
+            # Version 1: guild_id, created_at and claimed_at. created_at is recovered from the channel snowflake;
+            # guild_id is filled in by backfill_ticket_guilds once the channel cache is available.
+            await self.db.execute("ALTER TABLE tickets ADD COLUMN guild_id INTEGER")
+            await self.db.execute("ALTER TABLE tickets ADD COLUMN created_at REAL")
+            await self.db.execute("ALTER TABLE tickets ADD COLUMN claimed_at REAL")
+            await self.db.execute("UPDATE tickets SET created_at = ((channel_id >> 22) + 1420070400000) / 1000.0")
+
+        if version < 2:
+            # Version 2: captured_since. Existing tickets keep NULL, their log is missing everything before the deploy.
+            await self.db.execute("ALTER TABLE tickets ADD COLUMN captured_since REAL")
+
+        if version < 3:
+            # Version 3: last_activity and inactivity_warned_at, so a restart neither re-warns nor forgets a warning,
+            # and transcript_posted_at, so a retried delete job does not post the transcript twice.
+            # Nothing tells how long existing tickets have really been idle, so their clock starts at the upgrade
+            # instead of at the channel's creation. The message log, where present, has no bot flag; a bot message
+            # as the seed only delays the warning.
+            await self.db.execute("ALTER TABLE tickets ADD COLUMN last_activity REAL")
+            await self.db.execute("ALTER TABLE tickets ADD COLUMN inactivity_warned_at REAL")
+            await self.db.execute("ALTER TABLE tickets ADD COLUMN transcript_posted_at REAL")
+            async with self.db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ticket_messages'") as cursor:
+                has_message_log = await cursor.fetchone() is not None
+            if has_message_log:
+                await self.db.execute(
+                    """
+                    UPDATE tickets SET last_activity = (
+                        SELECT MAX(created_at) FROM ticket_messages m WHERE m.channel_id = tickets.channel_id AND m.kind = 'message'
+                    )
+                    """
+                )
+            await self.db.execute(
+                "UPDATE tickets SET last_activity = ? WHERE last_activity IS NULL", (discord.utils.utcnow().timestamp(),)
+            )
+
+    async def backfill_ticket_guilds(self):
+        await self.bot.wait_until_ready()
+        try:
+            # Without a guild there is no config, so these were skipped by the watch_inactivity calls in cog_load.
+            for ticket in await self.registry.backfill_guild_ids(self.bot):
+                self.watch_inactivity(ticket)
+        except Exception as e:
+            print(f"Fehler beim Zuordnen der Tickets zu Servern: {e}")
+
+    async def cog_unload(self):
+        self.bot.message_router.unregister("tickets")
+        self.bot.scheduler.unregister(TICKET_DELETE_JOB)
+        self.inactivity_task.cancel()
+        self.backfill_task.cancel()
+        self.flush_message_log_task.cancel()
+        await self.flush_message_log()
+        await self.registry.flush_activity()
+        await self.metrics.flush()
+        await self.attachment_archive.close()
+
+    async def run_ticket_delete_job(self, payload):
+        ticket = self.registry.get(payload["channel_id"])
+        if not ticket or ticket.channel_id in self.deleting:
+            # Already deleted or being deleted by a duplicate job, e.g. from before delete_scheduled existed.
+            return
+
+        self.deleting.add(ticket.channel_id)
+        try:
+            await self._delete_ticket(ticket, payload["actor_id"])
+        finally:
+            self.deleting.discard(ticket.channel_id)
+
+    def ticket_delete_given_up(self, payload):
+        # Out of retries; the confirm button has to work again.
+        ticket = self.registry.get(payload["channel_id"])
+        if ticket:
+            ticket.delete_scheduled = False
+
+    async def _delete_ticket(self, ticket: TicketState, actor_id: int):
+        # Steps are ordered so that a job retried after a crash picks up where it stopped; the transcript goes out once.
+        channel = self.bot.get_channel(ticket.channel_id)
+        if channel:
+            if ticket.transcript_posted_at is None:
+                await self.flush_message_log()
+                message_log = self.db if ticket.captured_since is not None else None
+                transcript_files = await create_transcript(channel, message_log, self.attachment_archive)
+                log_embed = discord.Embed(
+                    title="Ticket Gelöscht",
+                    description=f"Ticket **{channel.name}** wurde von <@{actor_id}> gelöscht.",
+                    color=discord.Color.dark_red()
+                )
+                await log_to_channel(self.bot, channel.guild, log_embed, files=transcript_files)
+                await self.registry.set_transcript_posted(ticket, discord.utils.utcnow().timestamp())
+            try:
+                await channel.delete()
+            except discord.NotFound:
+                pass
+
+        await self.registry.remove(ticket, actor_id)
+        self.untrack_channel(ticket.channel_id)
+        async with self.db_lock:
+            await delete_ticket_messages(self.db, ticket.channel_id)
+            await delete_ticket_attachments(self.db, ticket.channel_id)
+            await self.db.commit()
+
+    def _inactivity_deadline(self, ticket: TicketState):
+        config = get_config(ticket.guild_id) if ticket.guild_id else None
+        if not config or not config.ticket_inactivity_hours or ticket.status != 'offen':
+            return None
+
+        threshold = config.ticket_inactivity_hours * 3600
+        warning_lead = min(TICKET_INACTIVITY_WARNING_HOURS * 3600, threshold / 2)
+        if ticket.inactivity_warned_at is None:
+            return ticket.last_activity + threshold - warning_lead
+        # Members always get the full warning period, even if the bot was offline when it was due.
+        return max(ticket.last_activity + threshold, ticket.inactivity_warned_at + warning_lead)
+
+    def watch_inactivity(self, ticket: TicketState, not_before: float = 0.0):
+        if ticket.channel_id in self.inactivity_watched:
+            return
+        deadline = self._inactivity_deadline(ticket)
+        if deadline is not None:
+            heapq.heappush(self.inactivity_heap, (max(deadline, not_before), ticket.channel_id))
+            self.inactivity_watched.add(ticket.channel_id)
+
+    @tasks.loop(minutes=1)
+    async def inactivity_task(self):
+        now = discord.utils.utcnow().timestamp()
+        while self.inactivity_heap and self.inactivity_heap[0][0] <= now:
+            _, channel_id = heapq.heappop(self.inactivity_heap)
+            self.inactivity_watched.discard(channel_id)
+
+            ticket = self.registry.get(channel_id)
+            deadline = self._inactivity_deadline(ticket) if ticket else None
+            if deadline is None:
+                continue
+            if deadline > now:
+                # Activity since this entry was pushed; look again at the new deadline.
+                self.watch_inactivity(ticket)
+                continue
+
+            try:
+                await self.handle_inactive_ticket(ticket)
+            except Exception as e:
+                print(f"Fehler beim automatischen Schließen von Ticket {channel_id}: {e}")
+            # If nothing changed (e.g. the channel is not cached), retry on a later tick instead of spinning here.
+            self.watch_inactivity(ticket, not_before=now + 60)
+
+    @inactivity_task.before_loop
+    async def before_inactivity_task(self):
+        await self.bot.wait_until_ready()
+
+    async def handle_inactive_ticket(self, ticket: TicketState):
+        channel = self.bot.get_channel(ticket.channel_id)
+        config = get_config(ticket.guild_id)
+        if not channel:
+            return
+
+        if ticket.inactivity_warned_at is None:
+            await self.registry.set_warned(ticket, discord.utils.utcnow().timestamp())
+            close_at = int(self._inactivity_deadline(ticket))
+            embed = discord.Embed(
+                title="⏰ Ticket inaktiv",
+                description=f"In diesem Ticket wurde seit längerer Zeit nichts mehr geschrieben. Es wird <t:{close_at}:R> automatisch geschlossen, wenn bis dahin keine neue Nachricht kommt.",
+                color=discord.Color.dark_red()
+            )
+            await channel.send(content=f"<@{ticket.user_id}>", embed=embed)
+            return
+
+        await close_ticket(self.registry, channel, ticket, config)
+
+        embed = discord.Embed(
+            title="🔒 Ticket geschlossen",
+            description="Das Ticket wurde wegen Inaktivität automatisch geschlossen.",
+            color=discord.Color.dark_red()
+        )
+        await channel.send(embed=embed, view=ClosedTicketView(self.registry))
+
+        log_embed = discord.Embed(
+            title="Ticket Geschlossen",
+            description=f"Ticket {channel.mention} wurde wegen Inaktivität automatisch geschlossen.",
+            color=discord.Color.orange()
+        )
+        await log_to_channel(self.bot, channel.guild, log_embed)
+
+    def track_channel(self, channel_id: int):
+        self.bot.message_router.add_channel("tickets", channel_id)
+
+    def untrack_channel(self, channel_id: int):
+        self.bot.message_router.remove_channel("tickets", channel_id)
+        self.pending_messages = [row for row in self.pending_messages if row[0] != channel_id]
+
+    async def record_message_event(self, row):
+        self.pending_messages.append(row)
+        if len(self.pending_messages) >= self.MESSAGE_LOG_MAX_PENDING:
+            await self.flush_message_log()
+
+    async def flush_message_log(self):
+        async with self.db_lock:
+            if not self.pending_messages:
+                return
+
+            rows, self.pending_messages = self.pending_messages, []
+            try:
+                await save_ticket_messages(self.db, rows)
+                await self.db.commit()
+            except Exception as e:
+                # Keep the rows, in order, for the next attempt; the lock makes sure the rollback only drops these.
+                await self.db.rollback()
+                self.pending_messages[:0] = rows
+                print(f"Fehler beim Speichern der Ticket-Nachrichten: {e}")
+
+    @tasks.loop(seconds=2)
+    async def flush_message_log_task(self):
+        await self.flush_message_log()
+        await self.registry.flush_activity()
+        await self.metrics.flush()
+
+    async def handle_message(self, message: discord.Message):
+        # Only called by the message router for channels in self.registry.
+        if not message.author.bot:
+            ticket = self.registry.get(message.channel.id)
+            if ticket:
+                # The heap entry is not touched; it is re-pushed from last_activity when it comes up.
+                self.registry.touch(ticket, message.created_at.timestamp())
+
+        await self.record_message_event((
+            message.channel.id, message.id, 'message', message.author.id, str(message.author),
+            message.created_at.timestamp(), describe_message(message)
+        ))
+
+        if message.attachments:
+            hashes = await self.attachment_archive.store_all(message.attachments)
+            rows = [
+                (message.channel.id, message.id, attachment.filename, sha256)
+                for attachment, sha256 in zip(message.attachments, hashes) if sha256
+            ]
+            if rows:
+                async with self.db_lock:
+                    await save_ticket_attachments(self.db, rows)
+                    await self.db.commit()
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        if payload.channel_id not in self.registry.tickets:
+            return
+
+        message = payload.message
+        # Embed unfurls also arrive as edits, without edited_at; only record real content changes.
+        if message.edited_at is None:
+            return
+        if payload.cached_message and payload.cached_message.content == message.content:
+            return
+
+        await self.record_message_event((
+            payload.channel_id, message.id, 'edit', message.author.id, str(message.author),
+            message.edited_at.timestamp(), describe_message(message)
+        ))
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        if payload.channel_id not in self.registry.tickets:
+            return
+
+        await self.record_message_event((
+            payload.channel_id, payload.message_id, 'delete', None, None,
+            discord.utils.utcnow().timestamp(), None
+        ))
+
+    @discord.app_commands.command(name="ticket-stats", description="Zeigt Bearbeitungszeiten und Auslastung des Ticket-Teams an.")
+    @discord.app_commands.describe(mitglied="Teammitglied, dessen Statistiken angezeigt werden sollen.")
+    @discord.app_commands.checks.has_permissions(manage_messages=True)
+    async def ticket_stats(self, interaction: discord.Interaction, mitglied: discord.Member = None):
+        await self.metrics.flush()
+        guild_id = interaction.guild.id
+        member_id = mitglied.id if mitglied else 0
+
+        counts = await self.metrics.counts(guild_id, member_id)
+        claim_p50, claim_p90 = await self.metrics.percentiles(guild_id, member_id, 'time_to_claim')
+        close_p50, close_p90 = await self.metrics.percentiles(guild_id, member_id, 'time_to_close')
+
+        embed = discord.Embed(
+            title=f"📊 Ticket-Statistiken{f' von {mitglied.display_name}' if mitglied else ''}",
+            color=discord.Color.dark_red()
+        )
+        if not mitglied:
+            embed.add_field(name="Erstellt", value=counts.get('create', 0))
+        embed.add_field(name="Geclaimt", value=counts.get('claim', 0))
+        embed.add_field(name="Geschlossen", value=counts.get('close', 0))
+        embed.add_field(name="Zeit bis Claim", value=f"Median: {format_duration(claim_p50)}\n90%: {format_duration(claim_p90)}")
+        embed.add_field(name="Zeit bis Schließung", value=f"Median: {format_duration(close_p50)}\n90%: {format_duration(close_p90)}")
+
+        if not mitglied:
+            top_closers = await self.metrics.top_members(guild_id, 'close')
+            lines = []
+            for index, (top_member_id, count) in enumerate(top_closers):
+                member = interaction.guild.get_member(top_member_id)
+                lines.append(f"**#{index + 1}.** {member.display_name if member else f'User {top_member_id}'} - **{count}** geschlossen")
+            embed.add_field(name="Auslastung", value="\n".join(lines) or "Noch keine Daten vorhanden.", inline=False)
+
+        embed.set_footer(text="Zeiten gemessen ab Ticket-Erstellung, auf ca. 25% genau.")
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
     @commands.command(name="ticket-panel")
     @commands.has_permissions(manage_messages=True)
     async def ticketpanel(self, ctx: commands.Context):
@@ -360,19 +1334,18 @@ class TicketCog(commands.Cog):
             description="Klicke auf den Button, um ein neues Ticket zu erstellen und unser Team zu kontaktieren.",
             color=discord.Color.dark_red()
         )
-        await ctx.send(embed=embed, view=TicketCreateView(self.db))
+        await ctx.send(embed=embed, view=TicketCreateView(self.registry))
 
 class AddMember(commands.Cog):
-    def __init__(self, bot: commands.Bot):
+    def __init__(self, bot: commands.Bot, registry: TicketRegistry):
         self.bot = bot
-        self.db = bot.tickets_db
+        self.registry = registry
 
     @discord.app_commands.command(name="ticket-addmember", description="Fügt einen Benutzer zum aktuellen Ticket hinzu.")
     @discord.app_commands.checks.has_permissions(manage_messages=True)
     async def ticket_add_member(self, interaction: discord.Interaction, member: discord.Member):
         channel = interaction.channel
-        ticket_data = await get_ticket_data(self.db, channel.id)
-        if not ticket_data:
+        if not self.registry.get(channel.id):
             return await interaction.response.send_message("❌ Dieser Befehl kann nur in einem registrierten Ticket-Kanal verwendet werden.", ephemeral=True)
 
         overwrites = channel.overwrites_for(member)
@@ -390,16 +1363,15 @@ class AddMember(commands.Cog):
         await log_to_channel(self.bot, interaction.guild, log_embed)
 
 class RemoveMember(commands.Cog):
-    def __init__(self, bot: commands.Bot):
+    def __init__(self, bot: commands.Bot, registry: TicketRegistry):
         self.bot = bot
-        self.db = bot.tickets_db
+        self.registry = registry
 
     @discord.app_commands.command(name="ticket-removemember", description="Entfernt einen Nutzer aus dem aktuellen Ticket.")
     @discord.app_commands.checks.has_permissions(manage_messages=True)
     async def ticket_remove_member(self, interaction: discord.Interaction, member: discord.Member):
         channel = interaction.channel
-        ticket_data = await get_ticket_data(self.db, channel.id)
-        if not ticket_data:
+        if not self.registry.get(channel.id):
             return await interaction.response.send_message("❌ Dieser Befehl kann nur in einem registrierten Ticket-Kanal verwendet werden.", ephemeral=True)
 
         overwrites = channel.overwrites_for(member)
@@ -417,6 +1389,7 @@ class RemoveMember(commands.Cog):
         await log_to_channel(self.bot, interaction.guild, log_embed)
 
 async def setup(bot):
-    await bot.add_cog(TicketCog(bot))
-    await bot.add_cog(AddMember(bot))
-    await bot.add_cog(RemoveMember(bot))
\ No newline at end of file
+    ticket_cog = TicketCog(bot)
+    await bot.add_cog(ticket_cog)
+    await bot.add_cog(AddMember(bot, ticket_cog.registry))
+    await bot.add_cog(RemoveMember(bot, ticket_cog.registry))
\ No newline at end of file
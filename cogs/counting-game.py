@@ -1,8 +1,103 @@
+import os
+import asyncio
+import heapq
+from pathlib import Path
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 import aiosqlite
 import channels
 
+JOURNAL_PATH = Path("databases/counting.journal")
+
+
+class ChannelSequencer:
+    """Feeds each channel's messages to ``handler`` one at a time, lowest snowflake first.
+
+    Channels get independent workers, so a busy counting channel never holds up another guild.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.queues = {}
+        self.workers = {}
+
+    def submit(self, message: discord.Message):
+        channel_id = message.channel.id
+        heapq.heappush(self.queues.setdefault(channel_id, []), (message.id, message))
+        worker = self.workers.get(channel_id)
+        if worker is None or worker.done():
+            self.workers[channel_id] = asyncio.create_task(self._drain(channel_id))
+
+    async def _drain(self, channel_id: int):
+        queue = self.queues[channel_id]
+        # Let messages dispatched in the same loop iteration land in the heap before picking the first one.
+        await asyncio.sleep(0)
+        while queue:
+            _, message = heapq.heappop(queue)
+            try:
+                await self.handler(message)
+            except Exception as e:
+                print(f"Fehler beim Verarbeiten der Zählnachricht {message.id}: {e}")
+
+    def close(self):
+        for worker in self.workers.values():
+            worker.cancel()
+
+
+class CountingJournal:
+    """Append-only write-ahead log for counting moves that are not yet committed to counting.db.
+
+    Each line is ``seq server_id member_id count success``. Before a flush the live file is
+    rotated into a ``counting.journal.<seq>`` segment, which is deleted once the flush commits.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.file = None
+
+    def _segments(self):
+        segments = [p for p in self.path.parent.glob(f"{self.path.name}.*") if p.suffix[1:].isdigit()]
+        return sorted(segments, key=lambda p: int(p.suffix[1:]))
+
+    def replay(self):
+        entries = []
+        for segment in [*self._segments(), self.path]:
+            if not segment.exists():
+                continue
+            with segment.open("r", encoding="utf-8") as f:
+                for line in f:
+                    parts = line.split()
+                    # A torn last line from a crash mid-write is simply skipped.
+                    if len(parts) == 5 and all(p.isdigit() for p in parts):
+                        entries.append(tuple(int(p) for p in parts))
+        return entries
+
+    def open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = self.path.open("a", encoding="utf-8")
+
+    def append(self, seq: int, server_id: int, member_id: int, count: int, success: bool):
+        self.file.write(f"{seq} {server_id} {member_id} {count} {int(success)}\n")
+        self.file.flush()
+
+    def rotate(self, seq: int):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        if self.path.exists() and self.path.stat().st_size > 0:
+            self.path.rename(self.path.with_name(f"{self.path.name}.{seq}"))
+        self.open()
+        return self._segments()
+
+    def discard(self, segments):
+        for segment in segments:
+            segment.unlink(missing_ok=True)
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
 
 async def init_db(db: aiosqlite.Connection):
     await db.execute(
@@ -22,112 +117,240 @@ async def init_db(db: aiosqlite.Connection):
                                                     PRIMARY KEY (server_id, member_id)
            )"""
     )
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_stats_successes ON stats (server_id, successes)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_stats_highest ON stats (server_id, highest_count)")
+    await db.execute(
+        """CREATE TABLE IF NOT EXISTS counting_meta (
+                                                    name TEXT PRIMARY KEY,
+                                                    value INTEGER
+                                                )"""
+    )
     await db.commit()
 
 
-async def get_counting_data(db: aiosqlite.Connection, server_id: int):
-    async with db.execute("SELECT current_count, last_member_id, server_id FROM counting WHERE server_id = ?", (server_id,)) as cursor:
-        return await cursor.fetchone()
+async def get_all_counting_data(db: aiosqlite.Connection):
+    async with db.execute("SELECT server_id, current_count, last_member_id FROM counting") as cursor:
+        return await cursor.fetchall()
 
 
-async def continue_count(db: aiosqlite.Connection, server_id: int, count: int, last_member_id: int):
-    await db.execute("""INSERT OR REPLACE INTO counting (server_id, current_count, last_member_id) VALUES (?, ?, ?)""", (server_id, count, last_member_id))
-    await db.commit()
+async def save_counts(db: aiosqlite.Connection, rows):
+    await db.executemany("""INSERT OR REPLACE INTO counting (server_id, current_count, last_member_id) VALUES (?, ?, ?)""", rows)
+
+
+async def get_journal_seq(db: aiosqlite.Connection):
+    async with db.execute("SELECT value FROM counting_meta WHERE name = 'journal_seq'") as cursor:
+        row = await cursor.fetchone()
+    return row[0] if row else 0
+
+
+async def set_journal_seq(db: aiosqlite.Connection, seq: int):
+    await db.execute("INSERT OR REPLACE INTO counting_meta (name, value) VALUES ('journal_seq', ?)", (seq,))
 
 async def get_stat_data(db: aiosqlite.Connection, server_id: int, member_id: int):
     async with db.execute("SELECT highest_count, fails, successes FROM stats WHERE server_id = ? AND member_id = ?", (server_id, member_id)) as cursor:
         return await cursor.fetchone()
 
-async def save_stats(db: aiosqlite.Connection, user_id: int, server_id: int, success: bool, highest: int = None):
-    await db.execute(
-        "INSERT OR IGNORE INTO stats (server_id, member_id, highest_count, fails, successes) VALUES (?, ?, 0, 0, 0)",
-        (server_id, user_id)
+async def save_stats(db: aiosqlite.Connection, rows):
+    """Adds (server_id, member_id, highest, fails, successes) deltas in one statement per row; the caller commits."""
+    await db.executemany(
+        """INSERT INTO stats (server_id, member_id, highest_count, fails, successes) VALUES (?, ?, ?, ?, ?)
+           ON CONFLICT(server_id, member_id) DO UPDATE SET
+               highest_count = MAX(highest_count, excluded.highest_count),
+               fails = fails + excluded.fails,
+               successes = successes + excluded.successes""",
+        rows
     )
 
-    if success:
-        await db.execute("UPDATE stats SET successes = successes + 1 WHERE server_id = ? AND member_id = ?", (server_id, user_id))
-    else:
-        await db.execute("UPDATE stats SET fails = fails + 1 WHERE server_id = ? AND member_id = ?", (server_id, user_id))
-
-    if highest is not None:
-        await db.execute("UPDATE stats SET highest_count = ? WHERE server_id = ? AND member_id = ? AND ? > highest_count", (highest, server_id, user_id, highest))
-
-    await db.commit()
+async def get_stat_leaderboard(db: aiosqlite.Connection, server_id: int, column: str, limit: int = 10):
+    order_column = {"successes": "successes", "highest_count": "highest_count"}[column]
+    async with db.execute(
+        f"SELECT member_id, {order_column} FROM stats WHERE server_id = ? ORDER BY {order_column} DESC LIMIT ?",
+        (server_id, limit)
+    ) as cursor:
+        return await cursor.fetchall()
 
 class CountingGame(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self.db = bot.counting_db
+        # server_id -> (current_count, last_member_id); the source of truth while the bot runs.
+        self.counts = {}
+        self.dirty_servers = set()
+        # (server_id, member_id) -> [highest, fails, successes] not yet added to the stats table.
+        self.pending_stats = {}
+        self.journal = CountingJournal(JOURNAL_PATH)
+        self.journal_seq = 0
+        # Stats commands flush on demand while flush_counts_task runs; both share one connection and one journal.
+        self.flush_lock = asyncio.Lock()
+        self.sequencer = ChannelSequencer(self.process_count)
+        # Replies and reactions run outside the sequencer so Discord rate limits never hold up the judging.
+        self.feedback_tasks = set()
 
     async def cog_load(self):
-        await init_db(db=self.bot.counting_db)
+        await init_db(db=self.db)
+        await self.recover_state()
+        self.flush_counts_task.start()
+        self.bot.message_router.register("counting", self.handle_message, channel_ids=channels.COUNTING_CHANNEL_IDS)
+
+    async def recover_state(self):
+        for server_id, current_count, last_member_id in await get_all_counting_data(self.db):
+            self.counts[server_id] = (current_count or 0, last_member_id)
+
+        self.journal_seq = await get_journal_seq(self.db)
+        for seq, server_id, member_id, count, success in self.journal.replay():
+            if seq <= self.journal_seq:
+                continue
+            self._apply_count(server_id, member_id, count, success)
+            self.journal_seq = seq
+
+        self.journal.open()
+        await self.flush_counts()
+
+    def record_count(self, server_id: int, member_id: int, count: int, success: bool):
+        self.journal_seq += 1
+        self.journal.append(self.journal_seq, server_id, member_id, count, success)
+        self._apply_count(server_id, member_id, count, success)
+
+    def _apply_count(self, server_id: int, member_id: int, count: int, success: bool):
+        self.counts[server_id] = (count, member_id if success else None)
+        self.dirty_servers.add(server_id)
+
+        stats = self.pending_stats.setdefault((server_id, member_id), [0, 0, 0])
+        if success:
+            stats[0] = max(stats[0], count)
+            stats[2] += 1
+        else:
+            stats[1] += 1
 
+    async def flush_counts(self):
+        async with self.flush_lock:
+            if not self.dirty_servers:
+                return
 
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
-        if message.guild.id is None:
+            servers, self.dirty_servers = self.dirty_servers, set()
+            stats, self.pending_stats = self.pending_stats, {}
+            seq = self.journal_seq
+            segments = self.journal.rotate(seq)
+            try:
+                await save_counts(self.db, [(server_id, *self.counts[server_id]) for server_id in servers])
+                await save_stats(self.db, [(server_id, member_id, *values) for (server_id, member_id), values in stats.items()])
+                await set_journal_seq(self.db, seq)
+                await self.db.commit()
+            except Exception:
+                # The rotated segments stay on disk, so nothing is lost if we crash before the retry.
+                await self.db.rollback()
+                self.dirty_servers |= servers
+                for key, (highest, fails, successes) in stats.items():
+                    pending = self.pending_stats.setdefault(key, [0, 0, 0])
+                    pending[0] = max(pending[0], highest)
+                    pending[1] += fails
+                    pending[2] += successes
+                raise
+            self.journal.discard(segments)
+
+    @tasks.loop(seconds=2)
+    async def flush_counts_task(self):
+        try:
+            await self.flush_counts()
+        except Exception as e:
+            print(f"Fehler beim Speichern des Zählstands: {e}")
+
+    async def cog_unload(self):
+        self.bot.message_router.unregister("counting")
+        self.sequencer.close()
+        self.flush_counts_task.cancel()
+        await self.flush_counts()
+        self.journal.close()
+
+    def send_feedback(self, coro):
+        task = asyncio.create_task(self._send_feedback(coro))
+        self.feedback_tasks.add(task)
+        task.add_done_callback(self.feedback_tasks.discard)
+
+    async def _send_feedback(self, coro):
+        try:
+            await coro
+        except Exception as e:
+            print(f"Fehler beim Senden der Zählrückmeldung: {e}")
+
+    async def handle_message(self, message: discord.Message):
+        # Only called by the message router for channels in channels.COUNTING_CHANNEL_IDS.
+        if message.author.bot or message.guild is None:
             return
 
-        config = channels.get_config(message.guild.id)
-        counting_channel_id = config.counting_channel_id
+        if not message.content.strip().isdigit():
+            return
 
-        if message.channel.id == counting_channel_id:
-            if message.author.bot:
-                return
-            self.db = self.bot.counting_db
+        self.sequencer.submit(message)
 
-            data = await get_counting_data(db=self.db, server_id=message.guild.id)
-            if data:
-                current_count, last_member_id = data[0], data[1]
-            else:
-                current_count, last_member_id = 0, None
+    async def process_count(self, message: discord.Message):
+        # Runs inside the channel's sequencer, so no other message of this channel is judged concurrently.
+        # Nothing here awaits Discord: the move is judged and recorded before the next message is popped.
+        current_count, last_member_id = self.counts.get(message.guild.id, (0, None))
 
-            if not message.content.strip().isdigit():
-                return
+        new_count = int(message.content.strip())
 
-            if not message.content.strip().isdigit():
-                return
+        reason = None
+        if last_member_id == message.author.id:
+            reason = "Du kannst nicht zweimal hintereinander Zählen."
 
-            new_count = int(message.content.strip())
-
-            reason = None
-            if last_member_id == message.author.id:
-                reason = "Du kannst nicht zweimal hintereinander Zählen."
-
-            elif new_count != current_count + 1:
-                reason = "Falsche Zahl."
-
-            stat_data = await get_stat_data(db=self.db, server_id=message.guild.id, member_id=message.author.id)
-            if stat_data is not None:
-                highest = stat_data[0]
-            else:
-                highest = 0
-
-            if reason is not None:
-                embed = discord.Embed(
-                    title=f"⛓️‍💥 **{message.author.name}** hat das Zählen bei {current_count} zerstört!",
-                    description=f"{reason}\n Die nächste Zahl ist **1**",
-                    color=discord.Color.dark_red()
-                )
-                await message.reply(embed=embed, content=message.author.mention)
-                await continue_count(self.db, message.guild.id, 0, None)
-                await save_stats(self.db, message.author.id, message.guild.id, False)
-                return
+        elif new_count != current_count + 1:
+            reason = "Falsche Zahl."
+
+        if reason is not None:
+            self.record_count(message.guild.id, message.author.id, 0, False)
+            embed = discord.Embed(
+                title=f"⛓️‍💥 **{message.author.name}** hat das Zählen bei {current_count} zerstört!",
+                description=f"{reason}\n Die nächste Zahl ist **1**",
+                color=discord.Color.dark_red()
+            )
+            self.send_feedback(message.reply(embed=embed, content=message.author.mention))
+            return
 
 
-            else:
-                await message.add_reaction("✅")
-                db_count = current_count + 1
-                user_id = message.author.id
-                await continue_count(self.db, message.guild.id, db_count, user_id)
-                await save_stats(self.db, message.author.id, message.guild.id, True, db_count)
+        else:
+            db_count = current_count + 1
+            self.record_count(message.guild.id, message.author.id, db_count, True)
+            self.send_feedback(message.add_reaction("✅"))
 
 class StatCommand(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
 
+    async def flush_pending_counts(self):
+        counting = self.bot.get_cog("CountingGame")
+        if counting:
+            await counting.flush_counts()
+
+    @discord.app_commands.command(name="counting-leaderboard", description="Zeigt die besten Zähler des Servers an")
+    @discord.app_commands.describe(kategorie="Wonach die Rangliste sortiert werden soll.")
+    @discord.app_commands.choices(kategorie=[
+        discord.app_commands.Choice(name="Erfolge", value="successes"),
+        discord.app_commands.Choice(name="Rekordzahl", value="highest_count"),
+    ])
+    async def countingleaderboardcommand(self, interaction: discord.Interaction, kategorie: discord.app_commands.Choice[str] = None):
+        column = kategorie.value if kategorie else "successes"
+        await self.flush_pending_counts()
+        rows = await get_stat_leaderboard(self.bot.counting_db, interaction.guild.id, column)
+
+        leaderboard_msg = ""
+        for index, (member_id, value) in enumerate(rows):
+            member = interaction.guild.get_member(member_id)
+            name = member.display_name if member else f"User {member_id}"
+            suffix = "Erfolge" if column == "successes" else "als Rekord"
+            leaderboard_msg += f"**#{index + 1}.** {name} - **{value}** {suffix}\n"
+
+        embed = discord.Embed(
+            title="🔢 Zähl-Leaderboard",
+            description=leaderboard_msg or "Noch keine Daten vorhanden.",
+            color=discord.Color.dark_red()
+        )
+        await interaction.response.send_message(embed=embed)
+
     @discord.app_commands.command(name="counting-stats", description="Zeigt von einem User die Zähl-Statistiken an")
     @discord.app_commands.describe(member="Das Mitglied von dem die Statistiken angezeigt werden sollen.")
     async def countingstatscommand(self, interaction: discord.Interaction, member: discord.Member = None):
+        await self.flush_pending_counts()
 
         if member is None:
             stat_data = await get_stat_data(db=self.bot.counting_db, server_id=interaction.guild.id, member_id=interaction.user.id)
@@ -3,6 +3,8 @@ import discord
 from discord.ext import commands
 import dotenv
 import aiosqlite
+from message_router import MessageRouter
+from scheduler import JobScheduler
 
 os.environ["JISHAKU_NO_UNDERSCORE"] = "True"
 os.environ["JISHAKU_PREFIX"] = "hdev!"
@@ -35,6 +37,9 @@ class HellCat(commands.Bot):
         self.suggestions_db = None
         self.tickets_db = None
         self.counting_db = None
+        self.jobs_db = None
+        self.scheduler = None
+        self.message_router = MessageRouter()
 
         super().__init__(command_prefix=dynamic_prefix, intents=intents, help_command=None)
         os.makedirs("cogs", exist_ok=True)
@@ -46,6 +51,9 @@ class HellCat(commands.Bot):
         self.suggestions_db = await aiosqlite.connect("databases/suggestions.db")
         self.tickets_db = await aiosqlite.connect("databases/tickets.db")
         self.counting_db = await aiosqlite.connect("databases/counting.db")
+        self.jobs_db = await aiosqlite.connect("databases/jobs.db")
+        self.scheduler = JobScheduler(self.jobs_db)
+        await self.scheduler.setup()
         @self.command(name="restart", hidden=True)
         async def restart_cmd(ctx):
             if await self.is_owner(ctx.author):
@@ -54,6 +62,11 @@ class HellCat(commands.Bot):
             else:
                 return
 
+        @self.command(name="router-stats", hidden=True)
+        async def router_stats_cmd(ctx):
+            if await self.is_owner(ctx.author):
+                await ctx.send("\n".join(self.message_router.stats()) or "Keine Handler registriert.")
+
         done = True
         print("Starte Cogs-Ladevorgang...")
         for filename in os.listdir("cogs"):
@@ -67,6 +80,8 @@ class HellCat(commands.Bot):
         if done:
             print("✅ Alle Cogs geladen!")
 
+        self.scheduler.start(self)
+
         try:
             await self.load_extension('jishaku')
             jsk = self.get_command('jsk')
@@ -82,6 +97,15 @@ class HellCat(commands.Bot):
             synced = await self.tree.sync()
             print(f"[BETA] Erfolgreich {len(synced)} Slash-Befehle synchronisiert")
 
+    async def on_message(self, message):
+        await self.message_router.dispatch(message)
+        await self.process_commands(message)
+
+    async def close(self):
+        if self.scheduler:
+            self.scheduler.close()
+        await super().close()
+
     async def on_ready(self):
         await self.change_presence(activity=discord.Activity(type=discord.ActivityType.playing, name="Macht die Hölle heiß! 😈🔥"))
         print(f"Bot eingeloggt als {self.user}")
@@ -0,0 +1,91 @@
+# message_router.py
+import asyncio
+import time
+import discord
+
+
+class Route:
+    def __init__(self, name: str, handler, channel_ids=None, guild_ids=None, predicate=None):
+        self.name = name
+        self.handler = handler
+        self.channel_ids = set(channel_ids or ())
+        self.guild_ids = set(guild_ids or ())
+        self.predicate = predicate
+        # Decided at registration: a channel route whose channel set becomes empty must not turn global.
+        self.is_global = channel_ids is None and guild_ids is None
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+
+class MessageRouter:
+    """Fans incoming messages out to the cog handlers that registered interest in them.
+
+    Handlers are registered for channel IDs, guild IDs, or globally (neither), optionally with a
+    predicate. The handlers matching a channel are resolved once and cached per channel, so a
+    message in a channel nobody listens to costs a single dict lookup.
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self._resolved = {}
+        self._tasks = set()
+
+    def register(self, name: str, handler, *, channel_ids=None, guild_ids=None, predicate=None) -> Route:
+        route = Route(name, handler, channel_ids, guild_ids, predicate)
+        self.routes[name] = route
+        self._resolved.clear()
+        return route
+
+    def unregister(self, name: str):
+        if self.routes.pop(name, None):
+            self._resolved.clear()
+
+    def add_channel(self, name: str, channel_id: int):
+        self.routes[name].channel_ids.add(channel_id)
+        self._resolved.pop(channel_id, None)
+
+    def remove_channel(self, name: str, channel_id: int):
+        route = self.routes.get(name)
+        if route:
+            route.channel_ids.discard(channel_id)
+            self._resolved.pop(channel_id, None)
+
+    def _resolve(self, message: discord.Message):
+        guild_id = message.guild.id if message.guild else None
+        return tuple(
+            route for route in self.routes.values()
+            if route.is_global or message.channel.id in route.channel_ids or guild_id in route.guild_ids
+        )
+
+    async def dispatch(self, message: discord.Message):
+        routes = self._resolved.get(message.channel.id)
+        if routes is None:
+            routes = self._resolved[message.channel.id] = self._resolve(message)
+
+        for route in routes:
+            if route.predicate is None or route.predicate(message):
+                task = asyncio.create_task(self._run(route, message))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, route: Route, message: discord.Message):
+        start = time.perf_counter()
+        try:
+            await route.handler(message)
+        except Exception as e:
+            route.errors += 1
+            print(f"❌ Fehler im Nachrichten-Handler '{route.name}': {type(e).__name__}: {e}")
+        finally:
+            elapsed = time.perf_counter() - start
+            route.calls += 1
+            route.total_time += elapsed
+            route.max_time = max(route.max_time, elapsed)
+
+    def stats(self):
+        lines = []
+        for route in self.routes.values():
+            average = route.total_time / route.calls * 1000 if route.calls else 0.0
+            lines.append(f"{route.name}: {route.calls} Aufrufe, {route.errors} Fehler, Ø {average:.2f}ms, max {route.max_time * 1000:.2f}ms")
+        return lines
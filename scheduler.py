@@ -0,0 +1,132 @@
+# scheduler.py
+import asyncio
+import heapq
+import json
+import time
+import aiosqlite
+
+
+class JobScheduler:
+    """Persistent delayed jobs, driven by a single timer task.
+
+    Jobs are stored in SQLite and mirrored in a heap ordered by due time, so scheduling is one INSERT plus an
+    O(log n) push and the timer only ever sleeps until the earliest job. Jobs survive restarts: everything still
+    in the table is loaded again on startup, overdue jobs run right away. A job is deleted once its handler
+    succeeds; failing jobs are retried after RETRY_DELAY up to MAX_ATTEMPTS times, then handed to the kind's
+    ``on_give_up`` callback, if any.
+    """
+
+    MAX_ATTEMPTS = 3
+    RETRY_DELAY = 60
+
+    def __init__(self, db: aiosqlite.Connection):
+        self.db = db
+        self.handlers = {}
+        self.give_up_handlers = {}
+        self.heap = []
+        # Due jobs whose kind has no handler (cog not loaded), held until it registers.
+        self.parked = {}
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self._running = set()
+
+    async def setup(self):
+        await self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                                kind TEXT NOT NULL,
+                                                due_at REAL NOT NULL,
+                                                payload TEXT NOT NULL,
+                                                attempts INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        await self.db.commit()
+
+        async with self.db.execute("SELECT due_at, id, kind, payload, attempts FROM jobs") as cursor:
+            self.heap = [(due_at, job_id, kind, json.loads(payload), attempts) for due_at, job_id, kind, payload, attempts in await cursor.fetchall()]
+        heapq.heapify(self.heap)
+
+    def register(self, kind: str, handler, on_give_up=None):
+        self.handlers[kind] = handler
+        if on_give_up:
+            self.give_up_handlers[kind] = on_give_up
+        for job in self.parked.pop(kind, ()):
+            heapq.heappush(self.heap, job)
+        self.wakeup.set()
+
+    def unregister(self, kind: str):
+        self.handlers.pop(kind, None)
+        self.give_up_handlers.pop(kind, None)
+
+    def start(self, bot):
+        self.task = asyncio.create_task(self._run(bot))
+
+    def close(self):
+        if self.task:
+            self.task.cancel()
+        for task in self._running:
+            task.cancel()
+
+    async def schedule(self, kind: str, delay: float, payload: dict):
+        due_at = time.time() + delay
+        cursor = await self.db.execute(
+            "INSERT INTO jobs (kind, due_at, payload) VALUES (?, ?, ?)", (kind, due_at, json.dumps(payload))
+        )
+        await self.db.commit()
+
+        job = (due_at, cursor.lastrowid, kind, payload, 0)
+        heapq.heappush(self.heap, job)
+        if self.heap[0] is job:
+            self.wakeup.set()
+        return cursor.lastrowid
+
+    def payloads(self, kind: str):
+        jobs = [*self.heap, *self.parked.get(kind, ())]
+        return [payload for _, _, job_kind, payload, _ in jobs if job_kind == kind]
+
+    async def _run(self, bot):
+        await bot.wait_until_ready()
+        while True:
+            self.wakeup.clear()
+            now = time.time()
+            while self.heap and self.heap[0][0] <= now:
+                job = heapq.heappop(self.heap)
+                if job[2] not in self.handlers:
+                    self.parked.setdefault(job[2], []).append(job)
+                else:
+                    task = asyncio.create_task(self._execute(job))
+                    self._running.add(task)
+                    task.add_done_callback(self._running.discard)
+
+            timeout = self.heap[0][0] - now if self.heap else None
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _execute(self, job):
+        due_at, job_id, kind, payload, attempts = job
+        try:
+            await self.handlers[kind](payload)
+        except Exception as e:
+            attempts += 1
+            if attempts >= self.MAX_ATTEMPTS:
+                print(f"❌ Job {job_id} ({kind}) nach {attempts} Versuchen verworfen: {type(e).__name__}: {e}")
+                await self.db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+                on_give_up = self.give_up_handlers.get(kind)
+                if on_give_up:
+                    try:
+                        on_give_up(payload)
+                    except Exception as e:
+                        print(f"Fehler beim Aufgeben von Job {job_id} ({kind}): {type(e).__name__}: {e}")
+            else:
+                print(f"Fehler bei Job {job_id} ({kind}), neuer Versuch in {self.RETRY_DELAY}s: {type(e).__name__}: {e}")
+                due_at = time.time() + self.RETRY_DELAY
+                await self.db.execute("UPDATE jobs SET due_at = ?, attempts = ? WHERE id = ?", (due_at, attempts, job_id))
+                heapq.heappush(self.heap, (due_at, job_id, kind, payload, attempts))
+                self.wakeup.set()
+        else:
+            await self.db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        await self.db.commit()
@@ -0,0 +1,119 @@
+# tests/test_counting_stress.py
+"""Stress test for the counting game: three channels counting at once, messages delivered out of order.
+
+Runs under pytest or directly with ``python tests/test_counting_stress.py``.
+"""
+import asyncio
+import importlib.util
+import os
+import random
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import aiosqlite
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import channels
+from message_router import MessageRouter
+
+CHANNELS = 3
+COUNT_TO = 300
+# Messages that arrive within the same window may reach the bot in any order.
+WINDOW = 5
+
+
+def load_counting_module():
+    spec = importlib.util.spec_from_file_location("counting_game", ROOT / "cogs" / "counting-game.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeMessage:
+    def __init__(self, message_id: int, guild_id: int, channel_id: int, author_id: int, content: str):
+        self.id = message_id
+        self.guild = SimpleNamespace(id=guild_id)
+        self.channel = SimpleNamespace(id=channel_id)
+        self.author = SimpleNamespace(id=author_id, bot=False, name=f"user{author_id}", mention=f"<@{author_id}>")
+        self.content = content
+        self.reactions = []
+
+    async def add_reaction(self, emoji):
+        # Slow on purpose: judging must not wait for Discord.
+        await asyncio.sleep(0.05)
+        self.reactions.append(emoji)
+
+    async def reply(self, **kwargs):
+        raise AssertionError(f"Zählen bei {self.content} in Kanal {self.channel.id} zerstört")
+
+
+def build_messages():
+    messages = []
+    for number in range(1, COUNT_TO + 1):
+        for guild_id in range(1, CHANNELS + 1):
+            # Snowflakes grow with time; two members take turns in every channel.
+            messages.append(FakeMessage(number * 10 + guild_id, guild_id, 100 + guild_id, number % 2 + 1, str(number)))
+    return messages
+
+
+async def run_stress(workdir: Path):
+    os.chdir(workdir)
+    Path("databases").mkdir(exist_ok=True)
+    counting_game = load_counting_module()
+    channels.COUNTING_CHANNEL_IDS = {100 + guild_id for guild_id in range(1, CHANNELS + 1)}
+
+    db = await aiosqlite.connect("databases/counting.db")
+    bot = SimpleNamespace(counting_db=db, message_router=MessageRouter())
+    cog = counting_game.CountingGame(bot)
+    try:
+        await cog.cog_load()
+
+        messages = build_messages()
+        rng = random.Random(1234)
+        for start in range(0, len(messages), WINDOW):
+            window = messages[start:start + WINDOW]
+            rng.shuffle(window)
+            for message in window:
+                await bot.message_router.dispatch(message)
+            await asyncio.sleep(0)
+            if start % (WINDOW * 20) == 0:
+                # A stats command flushing while the periodic flush runs.
+                await asyncio.gather(cog.flush_counts(), cog.flush_counts())
+
+        async def settled():
+            while bot.message_router._tasks or any(not w.done() for w in cog.sequencer.workers.values()):
+                await asyncio.sleep(0.01)
+
+        # 900 sequential reactions would take 45s; with feedback off the sequencer it is well under this.
+        await asyncio.wait_for(settled(), timeout=5)
+        assert cog.counts == {guild_id: (COUNT_TO, COUNT_TO % 2 + 1) for guild_id in range(1, CHANNELS + 1)}
+
+        await asyncio.wait_for(asyncio.gather(*cog.feedback_tasks), timeout=5)
+        assert all(message.reactions == ["✅"] for message in messages)
+
+        await cog.flush_counts()
+        async with db.execute("SELECT server_id, current_count FROM counting ORDER BY server_id") as cursor:
+            assert await cursor.fetchall() == [(guild_id, COUNT_TO) for guild_id in range(1, CHANNELS + 1)]
+        async with db.execute("SELECT server_id, SUM(successes), SUM(fails), MAX(highest_count) FROM stats GROUP BY server_id") as cursor:
+            assert await cursor.fetchall() == [(guild_id, COUNT_TO, 0, COUNT_TO) for guild_id in range(1, CHANNELS + 1)]
+    finally:
+        await cog.cog_unload()
+        await db.close()
+
+
+def test_counting_stress(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # run_stress points the channel list at the fake channels; monkeypatch restores the real one afterwards.
+    monkeypatch.setattr(channels, "COUNTING_CHANNEL_IDS", channels.COUNTING_CHANNEL_IDS)
+    asyncio.run(run_stress(tmp_path))
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as directory:
+        asyncio.run(run_stress(Path(directory)))
+    print("OK")